@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from history import MessageStore
+from session import Session, parse_file_request
+
+# End-to-end benchmarks of the headless session engine: two sessions talk over loopback exactly
+# as two app instances would, with the UI replaced by callbacks. Covers bulk file transfer, chat
+# round trips, sustained drawing traffic, many small files one by one against one batch
+# archive, and loading chat history at startup.
+
+
+def _pair(tmp):
+    # A listens, B connects; returns once both ends have a session.
+    joined = threading.Semaphore(0)
+    a = Session(os.path.join(tmp, "a"), port=0, on_peer=lambda peer, up: up and joined.release())
+    b = Session(os.path.join(tmp, "b"), on_peer=lambda peer, up: up and joined.release())
+    a.name, b.name = "A", "B"
+    b.connect("127.0.0.1", a.listen())
+    for _ in range(2):
+        if not joined.acquire(timeout=10): raise RuntimeError("Sessions did not connect")
+    return a, b
+
+
+def _close(*sessions):
+    for session in sessions: session.close()
+    time.sleep(0.1)
+    for session in sessions: session.engine.stop()
+
+
+def _wait(event, what, timeout=120):
+    if not event.wait(timeout): raise RuntimeError(f"Timed out waiting for {what}")
+
+
+def bench_transfer(tmp, size_mb, repeat):
+    # Offer to file received and verified; fresh random content each run so nothing is deduplicated.
+    a, b = _pair(tmp)
+    received = threading.Event()
+
+    def on_command(command_str, peer):
+        if command_str.startswith("FILE_REQUEST:"):
+            file_id, filename, filesize, digest = parse_file_request(command_str)
+            b.accept_file(file_id, filename, filesize, digest, os.path.join(b.downloads_folder, filename), peer)
+
+    b.on_command, b.on_file = on_command, lambda file_id, filename, path: received.set()
+    rng, times = random.Random(size_mb), []
+    try:
+        for run in range(repeat):
+            src = os.path.join(tmp, f"src{run}.bin")
+            with open(src, 'wb') as f:
+                for _ in range(size_mb): f.write(rng.randbytes(1024 * 1024))
+            received.clear(); started = time.perf_counter()
+            a.send_file(src); _wait(received, "file transfer")
+            times.append(time.perf_counter() - started)
+            os.remove(src)
+    finally: _close(a, b)
+    best = min(times)
+    return {"bench": "session_transfer", "size_mb": size_mb, "seconds": round(best, 4), "mb_per_s": round(size_mb / best, 1)}
+
+
+def bench_small_files(tmp, count):
+    # The same small files offered one at a time (an offer, accept and transfer each) and then
+    # dropped together as one batch.
+    src, rng = os.path.join(tmp, "small"), random.Random(count)
+    os.makedirs(src)
+    for i in range(count):
+        with open(os.path.join(src, f"file{i}.bin"), 'wb') as f: f.write(rng.randbytes(rng.randrange(1024, 64 * 1024)))
+    a, b = _pair(tmp)
+    received, done, dest = threading.Semaphore(0), threading.Event(), os.path.join(tmp, "batch")
+
+    def on_command(command_str, peer):
+        if command_str.startswith("FILE_REQUEST:"):
+            file_id, filename, filesize, digest = parse_file_request(command_str)
+            b.accept_file(file_id, filename, filesize, digest, os.path.join(b.downloads_folder, filename), peer)
+        elif command_str.startswith("BATCH_REQUEST:"):
+            _, batch_id, summary = command_str.split(":", 2); b.accept_batch(batch_id, json.loads(summary), dest, peer)
+
+    b.on_command, b.on_file = on_command, lambda file_id, filename, path: received.release()
+    b.on_status = lambda message, color: message.startswith(("Received", "Batch transfer failed")) and done.set()
+    try:
+        started = time.perf_counter()
+        for i in range(count):
+            a.send_file(os.path.join(src, f"file{i}.bin"))
+            if not received.acquire(timeout=30): raise RuntimeError("Timed out waiting for file transfer")
+        one_by_one = time.perf_counter() - started
+        os.makedirs(dest); started = time.perf_counter()
+        a.send_batch([src]); _wait(done, "batch transfer")
+        batch = time.perf_counter() - started
+    finally: _close(a, b)
+    if len(os.listdir(os.path.join(dest, "small"))) != count: raise RuntimeError("batch: file count mismatch")
+    return {"bench": "small_files", "count": count, "one_by_one_s": round(one_by_one, 4), "batch_s": round(batch, 4)}
+
+
+def bench_chat_rtt(tmp, count):
+    # A sends a chat message, B echoes it back from its command callback.
+    a, b = _pair(tmp)
+    replies, rtts = threading.Semaphore(0), []
+    b.on_command = lambda command_str, peer: command_str.startswith("CHAT_MSG:") and b.send_command(command_str, peer)
+
+    def on_reply(command_str, peer):
+        rtts.append(time.perf_counter() - float(command_str.split(":", 3)[1])); replies.release()
+
+    a.on_command = on_reply
+    try:
+        for _ in range(count):
+            a.send_command(f"CHAT_MSG:{time.perf_counter()}:A:hello")
+            if not replies.acquire(timeout=10): raise RuntimeError("Timed out waiting for chat echo")
+    finally: _close(a, b)
+    rtts.sort()
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {"bench": "chat_rtt", "count": count, "p50_ms": ms(rtts[len(rtts) // 2]), "p95_ms": ms(rtts[int(len(rtts) * 0.95)]), "mean_ms": ms(statistics.mean(rtts))}
+
+
+def bench_draw(tmp, count):
+    # Freehand segments sent as fast as A can queue them, until B has seen them all.
+    a, b = _pair(tmp)
+    done, seen = threading.Event(), [0]
+
+    def on_draw(command_str, peer):
+        seen[0] += 1
+        if seen[0] == count: done.set()
+
+    b.on_command = on_draw
+    try:
+        started = time.perf_counter()
+        for i in range(count): a.send_command(f"DRAW:{i % 800},{i % 600},{i % 800 + 1},{i % 600 + 1},#000000,3")
+        _wait(done, "drawing events")
+        elapsed = time.perf_counter() - started
+    finally: _close(a, b)
+    return {"bench": "draw_events", "count": count, "seconds": round(elapsed, 4), "events_per_s": round(count / elapsed)}
+
+
+def bench_history(tmp, count):
+    # Startup cost of a long chat history: migrating the old log, the first page, then paging back.
+    log_path, rng = os.path.join(tmp, "chat_history.log"), random.Random(0)
+    with open(log_path, 'w') as f:
+        for i in range(count):
+            f.write(json.dumps(f"CHAT_MSG:{i}:{'AB'[i % 2]}:message {i} " + "x" * rng.randrange(80)) + "\n")
+            if i % 10 == 9: f.write(json.dumps(f"EDIT_MSG:{i - 1}:A:edited {i - 1}") + "\n")
+            if i % 50 == 49: f.write(json.dumps(f"DELETE_MSG:{i - 2}") + "\n")
+    store = MessageStore(os.path.join(tmp, "history.db"))
+    started = time.perf_counter()
+    store.migrate_log(log_path, lambda file_id, filename: filename)
+    migrated = time.perf_counter()
+    page = store.recent()
+    first_page = time.perf_counter()
+    pages = 1
+    while page: page = store.before(page[0][0]); pages += 1
+    paged = time.perf_counter()
+    return {"bench": "history_replay", "messages": count, "migrate_s": round(migrated - started, 4),
+            "first_page_ms": round((first_page - migrated) * 1000, 3), "all_pages_s": round(paged - first_page, 4), "pages": pages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end session benchmarks over loopback.")
+    parser.add_argument("--sizes", default="1,16,64", help="Comma-separated file sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--files", type=int, default=200, help="Small files, sent one by one and as a batch")
+    parser.add_argument("--pings", type=int, default=500, help="Chat round trips")
+    parser.add_argument("--draws", type=int, default=20000, help="Drawing events")
+    parser.add_argument("--messages", type=int, default=20000, help="Chat history length")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per result")
+    args = parser.parse_args()
+    runs = [(bench_transfer, int(size_mb), args.repeat) for size_mb in args.sizes.split(",")]
+    runs += [(bench_small_files, args.files), (bench_chat_rtt, args.pings), (bench_draw, args.draws), (bench_history, args.messages)]
+    for run, *params in runs:
+        with tempfile.TemporaryDirectory() as tmp:
+            for folder in ("a", "b"): os.makedirs(os.path.join(tmp, folder))
+            result = run(tmp, *params)
+        if args.json: print(json.dumps(result))
+        else: print("  ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
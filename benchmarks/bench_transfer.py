@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import protocol
+from mux import Multiplexer, INITIAL_WINDOW
+from net import NetworkEngine
+from protocol import FRAME_DATA, FRAME_WINDOW
+from transfer import ChunkSizer, FileSink, stream_file
+
+# Loopback file transfer benchmark: the pre-framing path (8 KB read/sendall, recv + write)
+# against the transfer engine (multiplexed channel on the asyncio network engine, received
+# straight into a memory-mapped output file).
+
+
+def _socket_pair():
+    server = socket.create_server(("127.0.0.1", 0))
+    client = socket.create_connection(server.getsockname())
+    conn, _ = server.accept(); server.close()
+    for s in (client, conn): s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return client, conn
+
+
+def legacy_transfer(src, dst, size):
+    sender, receiver = _socket_pair()
+
+    def send():
+        with open(src, 'rb') as f:
+            while chunk := f.read(8192): sender.sendall(chunk)
+
+    started = time.perf_counter()
+    threading.Thread(target=send, daemon=True).start()
+    received = 0
+    with open(dst, 'wb') as f:
+        while received < size:
+            chunk = receiver.recv(min(8192, size - received))
+            if not chunk: raise ConnectionError("Sender closed early")
+            f.write(chunk); received += len(chunk)
+    elapsed = time.perf_counter() - started
+    sender.close(); receiver.close()
+    return elapsed
+
+
+def engine_transfer(src, dst, size):
+    sink, done, counts = FileSink(dst, size), threading.Event(), {"received": 0, "unacked": 0}
+
+    def on_receiver(conn):
+        def on_frame(frame):
+            if frame.type != FRAME_DATA: return
+            n = len(frame.payload)
+            if frame.direct: frame.payload.release()
+            counts["received"] += n; counts["unacked"] += n
+            if counts["unacked"] >= INITIAL_WINDOW // 4: conn.write(protocol.encode_window(frame.channel, counts["unacked"])); counts["unacked"] = 0
+            if counts["received"] >= size: done.set()
+        conn.on_frame = on_frame
+
+    receiver = NetworkEngine(on_receiver, hello=lambda: {"name": "receiver"}, sink=lambda conn, ch, offset, n: sink.target(offset, n))
+    sender = NetworkEngine(lambda conn: None, hello=lambda: {"name": "sender"})
+    port = receiver.listen("127.0.0.1", 0).result()
+    conn = sender.open("127.0.0.1", port).result()
+    mux = Multiplexer(conn, on_error=done.set)
+    conn.on_frame = lambda frame: frame.type == FRAME_WINDOW and mux.grant(frame.channel, protocol.WINDOW.unpack(frame.payload)[0])
+    started = time.perf_counter()
+    threading.Thread(target=stream_file, args=(mux.open_channel(), src, ChunkSizer(mux, 0.0001)), daemon=True).start()
+    done.wait()
+    sink.close()
+    elapsed = time.perf_counter() - started
+    mux.close(); conn.close(); sender.stop(); receiver.stop()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback file transfer throughput, before and after the transfer engine.")
+    parser.add_argument("--sizes", default="16,64,256", help="Comma-separated file sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per result")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dst = os.path.join(tmp, "src.bin"), os.path.join(tmp, "dst.bin")
+        for size_mb in (int(s) for s in args.sizes.split(",")):
+            size = size_mb * 1024 * 1024
+            with open(src, 'wb') as f:
+                for _ in range(size_mb): f.write(os.urandom(1024 * 1024))
+            for name, run in (("legacy", legacy_transfer), ("engine", engine_transfer)):
+                best = min(run(src, dst, size) for _ in range(args.repeat))
+                if os.path.getsize(dst) != size: raise RuntimeError(f"{name}: size mismatch")
+                mbps = size_mb / best
+                if args.json: print(json.dumps({"bench": "file_transfer", "mode": name, "size_mb": size_mb, "seconds": round(best, 4), "mb_per_s": round(mbps, 1)}))
+                else: print(f"{name:>7} {size_mb:>5} MB  {best:7.3f} s  {mbps:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
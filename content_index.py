@@ -0,0 +1,70 @@
+import os
+import shutil
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from transfer import file_digest
+
+# --- Content Index ---
+# Maps the sha256 of whole files (the manifest digest) to local paths, so a file offered by a
+# peer that we already hold is copied locally instead of being sent again. Digests are cached by
+# (path, mtime, size): a file is only re-hashed after it changes. Known folders are indexed in the
+# background on a single worker, committing one file at a time, so a scan never competes with
+# transfers for more than one disk stream and is picked up where it left off on the next run.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, size INTEGER NOT NULL, digest TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS files_digest ON files (digest);
+"""
+
+
+def materialize(source, dest):
+    # A hardlink where the filesystem allows, otherwise a copy.
+    if os.path.exists(dest):
+        if os.path.samefile(source, dest): return
+        os.remove(dest)
+    try: os.link(source, dest)
+    except OSError: shutil.copyfile(source, dest)
+
+
+class ContentIndex:
+    def __init__(self, path):
+        self.db, self.lock = sqlite3.connect(path, check_same_thread=False), threading.Lock()
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL"); self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index")
+
+    def record(self, path, digest, stat=None):
+        # `stat` is the file's state when it was hashed, if the caller already had it.
+        stat = stat or os.stat(path)
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO files (path, mtime, size, digest) VALUES (?, ?, ?, ?)", (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, digest))
+
+    def digest(self, path):
+        path, stat = os.path.abspath(path), os.stat(path)
+        with self.lock: row = self.db.execute("SELECT mtime, size, digest FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[:2] == (stat.st_mtime_ns, stat.st_size): return row[2]
+        digest = file_digest(path)
+        self.record(path, digest, stat)
+        return digest
+
+    def lookup(self, digest, size):
+        # Returns a path whose content is still unchanged since it was hashed; stale rows are dropped.
+        with self.lock: rows = self.db.execute("SELECT path, mtime FROM files WHERE digest = ? AND size = ?", (digest, size)).fetchall()
+        for path, mtime in rows:
+            try: stat = os.stat(path)
+            except OSError: stat = None
+            if stat and (stat.st_mtime_ns, stat.st_size) == (mtime, size): return path
+            with self.lock, self.db: self.db.execute("DELETE FROM files WHERE path = ? AND mtime = ?", (path, mtime))
+        return None
+
+    def scan(self, paths):
+        # Files and folders (walked recursively) to index in the background.
+        self.worker.submit(self._scan, list(paths))
+
+    def _scan(self, paths):
+        for path in paths:
+            files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names] if os.path.isdir(path) else [path]
+            for file_path in files:
+                try: self.digest(file_path)
+                except OSError: pass
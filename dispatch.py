@@ -0,0 +1,43 @@
+import collections
+import threading
+import time
+
+# --- UI Dispatcher ---
+# Tk is not thread-safe, so network and worker threads never touch widgets directly: they post
+# events here and the Tk thread drains the queue every TICK_MS. A tick handles at most
+# BATCH_LIMIT events or BATCH_BUDGET seconds of work, so a flood of messages cannot starve input
+# handling. Runs of consecutive commands are handed to `on_commands` together, as
+# (command, source) pairs, so they can be coalesced and persisted as one batch.
+TICK_MS = 10
+BATCH_LIMIT = 500
+BATCH_BUDGET = 0.008
+
+
+class UIDispatcher:
+    def __init__(self, widget, on_commands):
+        self.widget, self.on_commands = widget, on_commands
+        self.queue, self.thread = collections.deque(), threading.current_thread()
+        widget.after(TICK_MS, self._drain)
+
+    def __len__(self): return len(self.queue)
+
+    def post(self, fn, *args, **kwargs): self.queue.append((fn, args, kwargs))
+    def post_command(self, command_str, source=None): self.queue.append((None, (command_str, source), None))
+
+    def call(self, fn, *args, **kwargs):
+        # Runs fn now when already on the Tk thread, otherwise on the next tick.
+        if threading.current_thread() is self.thread: fn(*args, **kwargs)
+        else: self.post(fn, *args, **kwargs)
+
+    def _drain(self):
+        deadline, commands = time.perf_counter() + BATCH_BUDGET, []
+        try:
+            for _ in range(BATCH_LIMIT):
+                if not self.queue or time.perf_counter() > deadline: break
+                fn, args, kwargs = self.queue.popleft()
+                if fn is None: commands.append(args); continue
+                if commands: self.on_commands(commands); commands = []
+                try: fn(*args, **kwargs)
+                except Exception as e: print(f"UI event error: {e}")
+            if commands: self.on_commands(commands)
+        finally: self.widget.after(1 if self.queue else TICK_MS, self._drain)
@@ -0,0 +1,91 @@
+import json
+import os
+import sqlite3
+import threading
+
+# --- Message Store ---
+# Chat and gallery history in SQLite. Only the current state of each message is kept (edits
+# update the row, deletes remove it), so startup cost depends on what is shown, not on how many
+# commands were ever exchanged. Messages are read in pages ordered by `seq`.
+# A gallery row is `local` when its path holds a file this side offered or received and
+# verified; only those are ever served to a peer. Rows made from a peer's announcement just
+# say where the file would be saved.
+PAGE_SIZE = 50
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE NOT NULL, sender TEXT NOT NULL, text TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS gallery (seq INTEGER PRIMARY KEY AUTOINCREMENT, file_id TEXT UNIQUE NOT NULL, filename TEXT NOT NULL, path TEXT NOT NULL, local INTEGER NOT NULL DEFAULT 0);
+"""
+CHAT_COMMANDS = ("CHAT_MSG", "EDIT_MSG", "DELETE_MSG", "CLEAR_CHAT")
+
+
+class MessageStore:
+    def __init__(self, path):
+        # Used from both the UI and network threads, so one connection is shared behind a lock.
+        self.db, self.lock = sqlite3.connect(path, check_same_thread=False), threading.Lock()
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL"); self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+            # Stores from before `local` existed: their rows cannot be told apart, so none are served.
+            if "local" not in [row[1] for row in self.db.execute("PRAGMA table_info(gallery)")]:
+                self.db.execute("ALTER TABLE gallery ADD COLUMN local INTEGER NOT NULL DEFAULT 0")
+
+    def _apply(self, command_str):
+        cmd = command_str.split(":", 1)[0]
+        if cmd == "CHAT_MSG":
+            _, msg_id, sender, message = command_str.split(":", 3)
+            self.db.execute("INSERT OR IGNORE INTO messages (id, sender, text) VALUES (?, ?, ?)", (msg_id, sender, message))
+        elif cmd == "EDIT_MSG":
+            _, msg_id, _, message = command_str.split(":", 3)
+            self.db.execute("UPDATE messages SET text = ? WHERE id = ?", (message, msg_id))
+        elif cmd == "DELETE_MSG": self.db.execute("DELETE FROM messages WHERE id = ?", (command_str.split(":", 1)[1],))
+        elif cmd == "CLEAR_CHAT": self.db.execute("DELETE FROM messages")
+
+    def apply(self, *commands):
+        with self.lock, self.db:
+            for command_str in commands: self._apply(command_str)
+
+    def add_file(self, file_id, filename, path, local=False):
+        # A file we later download ourselves keeps its place in the gallery but gets the new path.
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO gallery (file_id, filename, path, local) VALUES (?, ?, ?, ?) ON CONFLICT(file_id) DO UPDATE SET path = excluded.path, local = excluded.local",
+                            (file_id, filename, path, int(local)))
+
+    def remove_file(self, file_id=None):
+        with self.lock, self.db:
+            if file_id: self.db.execute("DELETE FROM gallery WHERE file_id = ?", (file_id,))
+            else: self.db.execute("DELETE FROM gallery")
+
+    def recent(self, limit=PAGE_SIZE):
+        # Returns (seq, id, sender, text) rows, oldest first.
+        with self.lock: rows = self.db.execute("SELECT seq, id, sender, text FROM messages ORDER BY seq DESC LIMIT ?", (limit,)).fetchall()
+        return rows[::-1]
+
+    def before(self, seq, limit=PAGE_SIZE):
+        with self.lock: rows = self.db.execute("SELECT seq, id, sender, text FROM messages WHERE seq < ? ORDER BY seq DESC LIMIT ?", (seq, limit)).fetchall()
+        return rows[::-1]
+
+    def file_path(self, file_id):
+        with self.lock: row = self.db.execute("SELECT path FROM gallery WHERE file_id = ?", (file_id,)).fetchone()
+        return row[0] if row else None
+
+    def local_path(self, file_id):
+        with self.lock: row = self.db.execute("SELECT path FROM gallery WHERE file_id = ? AND local", (file_id,)).fetchone()
+        return row[0] if row else None
+
+    def files(self):
+        with self.lock: return self.db.execute("SELECT file_id, filename, path FROM gallery ORDER BY seq").fetchall()
+
+    def migrate_log(self, log_path, gallery_path):
+        # One-time import of the old append-only chat_history.log; the log is kept as *.migrated.
+        commands, files = [], []
+        with open(log_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line: continue
+                command_str = json.loads(line) if line.startswith('"') else line
+                if command_str.startswith("ADD_TO_GALLERY:"):
+                    _, file_id, filename = command_str.split(":", 2); files.append((file_id, filename, gallery_path(file_id, filename)))
+                elif command_str.startswith(CHAT_COMMANDS): commands.append(command_str)
+        self.apply(*commands)
+        for file_id, filename, path in files: self.add_file(file_id, filename, path)
+        os.replace(log_path, log_path + ".migrated")
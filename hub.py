@@ -0,0 +1,67 @@
+import threading
+import protocol
+from protocol import FRAME_CMD, FLAG_ZLIB
+
+# --- Peer Hub ---
+# The connected peer sessions. Each peer has its own multiplexer, and so its own send queue
+# and writer, which means a slow peer only ever delays itself. A peer whose queued commands
+# pass MAX_BACKLOG is handed to `on_overflow` to be dropped, so one stalled peer cannot grow
+# memory without limit. Broadcasts encode a command at most twice (zcmd2 and plain) and queue
+# the same bytes for every peer; command frames are stateless, so relayed frames are
+# forwarded as received.
+MAX_BACKLOG = 16 * 1024 * 1024
+# Shared chat, canvas and gallery state that a hub forwards from one peer to all the others.
+RELAYED = frozenset(["CHAT_MSG", "EDIT_MSG", "DELETE_MSG", "CLEAR_CHAT", "DRAW", "STROKE_BEGIN", "STROKE", "STROKE_END", "CLEAR",
+                     "CANVAS_SYNC", "ADD_TO_GALLERY", "DELETE_FILE", "CLEAR_GALLERY"])
+
+
+class Peer:
+    def __init__(self, conn, mux):
+        self.conn, self.mux, self.info = conn, mux, conn.info
+        self.name, self.compress = conn.info.get("name") or conn.peer, "zcmd2" in conn.info["features"]
+
+
+class Hub:
+    def __init__(self, on_overflow):
+        self.on_overflow, self._peers, self._lock = on_overflow, {}, threading.Lock()
+
+    def __len__(self): return len(self._peers)
+
+    def __iter__(self):
+        with self._lock: return iter(list(self._peers.values()))
+
+    def add(self, conn, mux):
+        peer = Peer(conn, mux)
+        with self._lock: self._peers[conn] = peer
+        return peer
+
+    def remove(self, conn):
+        with self._lock: return self._peers.pop(conn, None)
+
+    def get(self, conn): return self._peers.get(conn)
+
+    def send_frame(self, peer, frame_bytes):
+        if not peer.mux.send(frame_bytes): return False
+        if peer.mux.backlog > MAX_BACKLOG: self.on_overflow(peer)
+        return True
+
+    def send(self, peer, command_str): return self.send_frame(peer, protocol.encode_command(command_str, compress=peer.compress))
+
+    def broadcast(self, command_str, exclude=None):
+        encoded = {}
+        for peer in self:
+            if peer is exclude: continue
+            if peer.compress not in encoded: encoded[peer.compress] = protocol.encode_command(command_str, compress=peer.compress)
+            self.send_frame(peer, encoded[peer.compress])
+
+    def forward(self, frame, source):
+        # Only peers without zcmd2 need a re-encoded copy of a compressed frame.
+        raw = plain = None
+        for peer in self:
+            if peer is source: continue
+            if frame.flags & FLAG_ZLIB and not peer.compress:
+                plain = plain or protocol.encode_frame(FRAME_CMD, frame.text().encode('utf-8'))
+                self.send_frame(peer, plain)
+            else:
+                raw = raw or protocol.encode_frame(FRAME_CMD, bytes(frame.payload), flags=frame.flags)
+                self.send_frame(peer, raw)
@@ -1,18 +1,24 @@
+import time
+STARTED = time.perf_counter()
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import colorchooser, filedialog, messagebox
-import socket
 import threading
 import os
 import json
 import uuid
-from PIL import Image, ImageTk
+import itertools
 from tkinterdnd2 import DND_FILES, TkinterDnD
-import base64
-import time
-import requests
-import webbrowser
 import sys
+from session import Session, parse_file_request, safe_filename
+from metrics import format_report, format_transfer, SAMPLE_INTERVAL_MS
+from dispatch import UIDispatcher
+from history import CHAT_COMMANDS
+from thumbnails import ThumbnailCache, ThumbnailPool
+from virtual_list import VirtualList
+from strokes import StrokeBuilder, StrokeCanvas, StrokeStore, coalesce, FLUSH_INTERVAL_MS
+# PIL (thumbnails, canvas snapshots) and requests (the updater) are imported where first used.
+IMPORTED = time.perf_counter()
 
 # --- Custom Tooltip Class ---
 class Tooltip:
@@ -42,7 +48,7 @@ class Tooltip:
 
 # --- Custom Dialogs ---
 class FileAcceptDialog(ctk.CTkToplevel):
-    def __init__(self, master, filename, filesize, callback):
+    def __init__(self, master, filename, filesize, callback, known=False):
         super().__init__(master)
         self.callback = callback
         self.title("Incoming File")
@@ -51,6 +57,7 @@ class FileAcceptDialog(ctk.CTkToplevel):
         file_type = os.path.splitext(filename)[1].upper()[1:] or "Unknown"
         size_mb = filesize / (1024 * 1024)
         info_text = f"Name: {filename}\nType: {file_type}\nSize: {size_mb:.2f} MB"
+        if known: info_text += "\nAlready on this computer; it will be copied, not downloaded"
         ctk.CTkLabel(self, text="Incoming File Transfer Request", font=ctk.CTkFont(size=16, weight="bold")).pack(pady=10)
         ctk.CTkLabel(self, text=info_text, justify="left").pack(pady=10)
         button_frame = ctk.CTkFrame(self, fg_color="transparent"); button_frame.pack(pady=10)
@@ -60,27 +67,65 @@ class FileAcceptDialog(ctk.CTkToplevel):
     def accept(self): self.destroy(); self.callback(True)
     def decline(self): self.destroy(); self.callback(False)
 
+class BatchAcceptDialog(ctk.CTkToplevel):
+    # One decision for a whole batch; the summary lists the first few names.
+    def __init__(self, master, summary, callback):
+        super().__init__(master)
+        self.callback = callback
+        self.title("Incoming Files")
+        self.geometry("420x320")
+        self.transient(master); self.grab_set()
+        more = summary["files"] - len(summary["names"])
+        info_text = f"Files: {summary['files']}\nSize: {summary['size'] / (1024 * 1024):.2f} MB\n\n" + "\n".join(summary["names"]) + (f"\n...and {more} more" if more > 0 else "")
+        ctk.CTkLabel(self, text="Incoming Batch Transfer Request", font=ctk.CTkFont(size=16, weight="bold")).pack(pady=10)
+        ctk.CTkLabel(self, text=info_text, justify="left").pack(pady=10)
+        button_frame = ctk.CTkFrame(self, fg_color="transparent"); button_frame.pack(pady=10)
+        ctk.CTkButton(button_frame, text="Accept", command=self.accept).pack(side="left", padx=10)
+        ctk.CTkButton(button_frame, text="Decline", command=self.decline, fg_color="#D32F2F", hover_color="#B71C1C").pack(side="left", padx=10)
+
+    def accept(self): self.destroy(); self.callback(True)
+    def decline(self): self.destroy(); self.callback(False)
+
 class SettingsDialog(ctk.CTkToplevel):
     def __init__(self, master, app_instance):
         super().__init__(master)
         self.app = app_instance
         self.title("Settings")
-        self.geometry("400x300")
+        self.geometry("520x700")
         self.transient(master); self.grab_set()
         ctk.CTkLabel(self, text="Vortex Tunnel Settings", font=ctk.CTkFont(size=20, weight="bold")).pack(pady=20)
         info_frame = ctk.CTkFrame(self); info_frame.pack(pady=10, padx=20, fill="x")
         ctk.CTkLabel(info_frame, text=f"Version: {self.app.CURRENT_VERSION}").pack(anchor="w", padx=10)
         ctk.CTkLabel(info_frame, text=f"My Name: {self.app.my_name or 'Not Selected'}").pack(anchor="w", padx=10)
-        ctk.CTkLabel(info_frame, text=f"Peer Name: {self.app.peer_name or 'Not Connected'}").pack(anchor="w", padx=10)
+        ctk.CTkLabel(info_frame, text=f"Peers: {', '.join(peer.name for peer in self.app.session.hub) or 'Not Connected'}").pack(anchor="w", padx=10)
+        self.striped_switch = ctk.CTkSwitch(self, text="Use parallel connections for large files", command=lambda: setattr(self.app.session, 'striped_transfers', bool(self.striped_switch.get())))
+        if self.app.session.striped_transfers: self.striped_switch.select()
+        self.striped_switch.pack(pady=5)
+        self.hub_switch = ctk.CTkSwitch(self, text="Host a group session (hub)", command=lambda: setattr(self.app.session, 'hub_mode', bool(self.hub_switch.get())))
+        if self.app.session.hub_mode: self.hub_switch.select()
+        self.hub_switch.pack(pady=5)
+        ctk.CTkLabel(self, text="Performance", font=ctk.CTkFont(size=14, weight="bold")).pack(pady=(10, 0))
+        self.stats_box = ctk.CTkTextbox(self, height=220, font=ctk.CTkFont(family="Consolas", size=11)); self.stats_box.pack(padx=20, pady=5, fill="both", expand=True)
+        self.metrics_switch = ctk.CTkSwitch(self, text="Record metrics to metrics.jsonl", command=lambda: setattr(self.app, 'record_metrics', bool(self.metrics_switch.get())))
+        if self.app.record_metrics: self.metrics_switch.select()
+        self.metrics_switch.pack(pady=5)
         self.update_button = ctk.CTkButton(self, text="Check for Updates", command=self.check_for_updates)
         self.update_button.pack(pady=10)
         ctk.CTkButton(self, text="Close", command=self.destroy).pack(pady=10)
+        self.refresh_stats()
+
+    def refresh_stats(self):
+        if not self.winfo_exists(): return
+        self.stats_box.configure(state="normal"); self.stats_box.delete("1.0", tk.END)
+        self.stats_box.insert("1.0", format_report(self.app.session.metrics.snapshot())); self.stats_box.configure(state="disabled")
+        self.after(SAMPLE_INTERVAL_MS, self.refresh_stats)
 
     def check_for_updates(self):
         self.update_button.configure(text="Checking...", state="disabled")
         threading.Thread(target=self._update_thread, daemon=True).start()
 
     def _update_thread(self):
+        import requests
         try:
             version_url = "https://raw.githubusercontent.com/Starbug10/Vortex-Tunnel-V2/main/version.json"
             response = requests.get(version_url, timeout=10)
@@ -99,6 +144,7 @@ class SettingsDialog(ctk.CTkToplevel):
             self.update_button.configure(text="Check for Updates", state="normal")
 
     def download_and_run_update(self, latest_info):
+        import requests
         try:
             release_tag = latest_info["release_tag"]
             asset_name = latest_info["asset_name"]
@@ -120,6 +166,7 @@ class SettingsDialog(ctk.CTkToplevel):
 # --- Main Application ---
 class VortexTunnelApp(ctk.CTkFrame):
     CURRENT_VERSION = "0.0.1"
+    CUSTOM_PROFILE = "I am someone else..."
     
     def __init__(self, master, **kwargs):
         super().__init__(master, **kwargs)
@@ -128,17 +175,25 @@ class VortexTunnelApp(ctk.CTkFrame):
         os.makedirs(app_data_dir, exist_ok=True)
         self.NATHAN_NAME, self.MAJID_NAME = "Nathan", "Majid"
         self.NATHAN_IP, self.MAJID_IP = "100.122.120.65", "100.93.161.73"
-        self.my_name, self.peer_name = None, None
+        self.my_name, self.peer_name, self.custom_name = None, None, None
         self.config_file = os.path.join(app_data_dir, "config.json")
+        self.metrics_file, self.record_metrics = os.path.join(app_data_dir, "metrics.jsonl"), False
         self.chat_history_file = os.path.join(app_data_dir, "chat_history.log")
-        self.downloads_folder = os.path.join(app_data_dir, "Vortex_Downloads")
-        os.makedirs(self.downloads_folder, exist_ok=True)
-        self.host_ip_listen, self.port = "0.0.0.0", 12345
-        self.connection, self.connected = None, threading.Event()
-        self.pending_transfers, self.chat_messages, self.file_gallery_items = {}, {}, {}
-        self._create_widgets()
-        self.load_config_and_history()
-        self.start_server()
+        self.oldest_chat_seq, self.gallery_thumbs = None, {}
+        self.stroke_store = StrokeStore(os.path.join(app_data_dir, "Canvas"))
+        self.thumbnails = ThumbnailPool(ThumbnailCache(os.path.join(app_data_dir, "Thumbnails")))
+        self.ui = UIDispatcher(self, self.process_commands)
+        # The session runs the protocol on its own threads; everything it reports reaches Tk
+        # through the UI dispatcher.
+        self.session = Session(app_data_dir, on_command=self.ui.post_command, on_status=self.update_status,
+                               on_file=lambda *args: self.ui.post(self.add_file_to_gallery, *args), on_peer=lambda peer, joined: self.ui.post(self._peer_changed, peer, joined))
+        self.message_store, self.content_index, self.metrics = self.session.message_store, self.session.content_index, self.session.metrics
+        self.after(SAMPLE_INTERVAL_MS, self._sample_metrics, time.monotonic() + SAMPLE_INTERVAL_MS / 1000)
+        self._startup_phase("imports", IMPORTED); self._startup_phase("session")
+        self._create_widgets(); self._startup_phase("widgets")
+        self.load_config(); self.start_server(); self._startup_phase("config")
+        # History, the reconnect prompt and the content index scan wait for the first frame.
+        self.first_frame_shown = False; self.bind("<Map>", self._first_frame, add="+")
 
     def _create_widgets(self):
         self.grid_columnconfigure(0, weight=1); self.grid_rowconfigure(1, weight=1)
@@ -147,18 +202,20 @@ class VortexTunnelApp(ctk.CTkFrame):
         self.connect_button = ctk.CTkButton(top_frame, text="Connect", command=self.connect_to_peer); self.connect_button.pack(side="left", padx=5, pady=5)
         self.settings_button = ctk.CTkButton(top_frame, text="⚙️", width=30, command=self.open_settings); self.settings_button.pack(side="left", padx=5, pady=5)
         self.pin_button = ctk.CTkButton(top_frame, text="📌", width=30, command=self.toggle_topmost); self.pin_button.pack(side="left", padx=5, pady=5); self.is_pinned = False
-        self.tab_view = ctk.CTkTabview(self); self.tab_view.grid(row=1, column=0, padx=10, pady=(0,10), sticky="nsew")
+        self.tab_view = ctk.CTkTabview(self, command=lambda: self._build_tab(self.tab_view.get())); self.tab_view.grid(row=1, column=0, padx=10, pady=(0,10), sticky="nsew")
         self.tab_view.add("Chat"); self.tab_view.add("Drawing"); self.tab_view.add("Files")
-        self._create_chat_tab(); self._create_drawing_tab(); self._create_files_tab()
+        # Only Chat is built up front; the others are built the first time they are shown.
+        self._create_chat_tab(); self.unbuilt_tabs = {"Drawing": self._create_drawing_tab, "Files": self._create_files_tab}
         bottom_frame = ctk.CTkFrame(self); bottom_frame.grid(row=2, column=0, padx=10, pady=(0,10), sticky="ew")
-        profile_options = ["Select Profile", f"I am {self.NATHAN_NAME}", f"I am {self.MAJID_NAME}"]
+        profile_options = ["Select Profile", f"I am {self.NATHAN_NAME}", f"I am {self.MAJID_NAME}", self.CUSTOM_PROFILE]
         self.profile_menu = ctk.CTkOptionMenu(bottom_frame, values=profile_options, command=self.profile_selected); self.profile_menu.pack(side="left", padx=5, pady=5)
         self.status_label = ctk.CTkLabel(bottom_frame, text="Status: Disconnected", text_color="red"); self.status_label.pack(side="left", padx=10, pady=5)
 
     def _create_chat_tab(self):
         chat_tab = self.tab_view.tab("Chat")
         chat_tab.grid_columnconfigure(0, weight=1); chat_tab.grid_rowconfigure(0, weight=1)
-        self.chat_frame = ctk.CTkScrollableFrame(chat_tab); self.chat_frame.grid(row=0, column=0, sticky="nsew")
+        # Older history is paged in when the view reaches the top.
+        self.chat_list = VirtualList(chat_tab, self._make_chat_row, self._bind_chat_row, on_top=self._load_older_messages); self.chat_list.grid(row=0, column=0, sticky="nsew")
         input_frame = ctk.CTkFrame(chat_tab, fg_color="transparent"); input_frame.grid(row=1, column=0, sticky="ew")
         input_frame.grid_columnconfigure(0, weight=1)
         self.chat_entry = ctk.CTkEntry(input_frame, placeholder_text="Type a message or drag a file here..."); self.chat_entry.grid(row=0, column=0, padx=5, pady=5, sticky="ew")
@@ -174,38 +231,62 @@ class VortexTunnelApp(ctk.CTkFrame):
         ctk.CTkSlider(controls, from_=1, to=50, command=lambda v: setattr(self, 'brush_size', int(v))).pack(side="left", expand=True, fill="x")
         ctk.CTkButton(controls, text="Clear Canvas", command=self.clear_canvas).pack(side="right", padx=5, pady=5)
         self.canvas = tk.Canvas(draw_tab, bg="#1a1a1a", highlightthickness=0); self.canvas.grid(row=1, column=0, sticky="nsew")
-        self.old_x, self.old_y = None, None
-        self.canvas.bind("<B1-Motion>", self.draw); self.canvas.bind("<ButtonRelease-1>", self.reset_drawing_state)
+        self.stroke_canvas, self.active_stroke = StrokeCanvas(self.canvas, on_complete=self._stroke_completed), None
+        self.canvas_snapshot = None
+        self._show_canvas_state()
+        self.canvas.bind("<ButtonPress-1>", self.start_stroke); self.canvas.bind("<B1-Motion>", self.draw); self.canvas.bind("<ButtonRelease-1>", self.reset_drawing_state)
 
     def _create_files_tab(self):
         files_tab = self.tab_view.tab("Files")
         files_tab.grid_columnconfigure(0, weight=1); files_tab.grid_rowconfigure(0, weight=1)
-        self.gallery_frame = ctk.CTkScrollableFrame(files_tab, label_text="Shared File Gallery")
-        self.gallery_frame.grid(row=0, column=0, sticky="nsew")
+        self.gallery_list = VirtualList(files_tab, self._make_gallery_row, self._bind_gallery_row, label_text="Shared File Gallery")
+        self.gallery_list.grid(row=0, column=0, sticky="nsew")
+        # Everything announced before the tab was built is already in the message store.
+        for file_id, filename, path in self.message_store.files():
+            if os.path.exists(path): self.add_file_to_gallery(file_id, filename, path)
+
+    def _build_tab(self, name):
+        builder = self.unbuilt_tabs.pop(name, None)
+        if builder: started = time.perf_counter(); builder(); self.metrics.observe(f"tab_build.{name}", time.perf_counter() - started)
 
     def open_settings(self): SettingsDialog(self.master, self)
     def choose_color(self): color_code = colorchooser.askcolor(title="Choose color"); self.color = color_code[1] if color_code else self.color
     def toggle_topmost(self): self.is_pinned = not self.is_pinned; self.master.attributes("-topmost", self.is_pinned); self.pin_button.configure(fg_color=("#3b8ed0", "#1f6aa5") if self.is_pinned else ctk.ThemeManager.theme["CTkButton"]["fg_color"])
-    def handle_drop(self, event): filepath = self.master.tk.splitlist(event.data)[0]; self.send_file(filepath)
+    def handle_drop(self, event):
+        # A single file is offered on its own; several items, or any folder, go as one batch.
+        paths = [path for path in self.master.tk.splitlist(event.data) if os.path.exists(path)]
+        if len(paths) == 1 and os.path.isfile(paths[0]): self.send_file(paths[0])
+        elif paths: self.session.send_batch(paths)
     
-    def add_chat_message(self, msg_id, sender, message, is_own, is_file=False, file_info=None):
-        if msg_id in self.chat_messages: return
-        row_frame = ctk.CTkFrame(self.chat_frame, fg_color="transparent"); row_frame.pack(fill="x", padx=5, pady=2)
-        row_frame.grid_columnconfigure(1 if is_own else 0, weight=1)
-        msg_frame = ctk.CTkFrame(row_frame); msg_frame.grid(row=0, column=1 if is_own else 0, sticky="e" if is_own else "w")
-        ctk.CTkLabel(msg_frame, text=f"{sender}:", font=ctk.CTkFont(weight="bold")).pack(side="left", padx=(10, 5), pady=5)
-        if is_file:
-            file_frame = ctk.CTkFrame(msg_frame, fg_color="gray20"); file_frame.pack(side="left", padx=5, pady=5)
-            ctk.CTkLabel(file_frame, text=f"📄 {file_info['name']}").pack(anchor="w")
-            ctk.CTkLabel(file_frame, text=f"Size: {file_info['size']:.2f} MB", font=("Arial", 9)).pack(anchor="w")
-        else:
-            msg_label = ctk.CTkLabel(msg_frame, text=message, wraplength=self.winfo_width() - 250, justify="left"); msg_label.pack(side="left", padx=5, pady=5, expand=True, fill="x")
-        if is_own and not is_file:
-            btn_frame = ctk.CTkFrame(msg_frame, fg_color="transparent"); btn_frame.pack(side="right", padx=5, pady=5)
-            ctk.CTkButton(btn_frame, text="✏️", width=20, command=lambda id=msg_id: self.edit_chat_prompt(id)).pack()
-            ctk.CTkButton(btn_frame, text="🗑️", width=20, command=lambda id=msg_id: self.send_command(f"DELETE_MSG:{id}")).pack(pady=(2,0))
-        self.chat_messages[msg_id] = row_frame
-        self.after(100, self.chat_frame._parent_canvas.yview_moveto, 1.0)
+    def add_chat_message(self, msg_id, sender, message):
+        self.chat_list.append(msg_id, {"sender": sender, "text": message}); self.chat_list.scroll_to_end()
+
+    # Chat and gallery rows are pooled by VirtualList: _make_*_row builds the widgets once and
+    # _bind_*_row points them at whichever record is scrolled into view.
+    def _make_chat_row(self, parent):
+        row = ctk.CTkFrame(parent, fg_color="transparent"); row.grid_columnconfigure(0, weight=1)
+        row.bubble = ctk.CTkFrame(row)
+        row.sender = ctk.CTkLabel(row.bubble, text="", font=ctk.CTkFont(weight="bold")); row.sender.pack(side="left", padx=(10, 5), pady=5)
+        row.text = ctk.CTkLabel(row.bubble, text="", justify="left"); row.text.pack(side="left", padx=5, pady=5, expand=True, fill="x")
+        row.buttons = ctk.CTkFrame(row.bubble, fg_color="transparent")
+        row.edit = ctk.CTkButton(row.buttons, text="✏️", width=20); row.edit.pack()
+        row.delete = ctk.CTkButton(row.buttons, text="🗑️", width=20); row.delete.pack(pady=(2,0))
+        return row
+
+    def _bind_chat_row(self, row, msg_id, record):
+        is_own = record["sender"] == self.my_name
+        row.bubble.grid(row=0, column=0, sticky="e" if is_own else "w", padx=5, pady=2)
+        row.sender.configure(text=f"{record['sender']}:"); row.text.configure(text=record["text"], wraplength=self.winfo_width() - 250)
+        if is_own:
+            row.edit.configure(command=lambda: self.edit_chat_prompt(msg_id)); row.delete.configure(command=lambda: self.session.send_command(f"DELETE_MSG:{msg_id}"))
+            row.buttons.pack(side="right", padx=5, pady=5)
+        else: row.buttons.pack_forget()
+
+    def _load_older_messages(self):
+        if self.oldest_chat_seq is None: return
+        rows = self.message_store.before(self.oldest_chat_seq)
+        self.oldest_chat_seq = rows[0][0] if rows else None
+        self.chat_list.prepend([(msg_id, {"sender": sender, "text": message}) for _, msg_id, sender, message in rows])
 
     def send_chat_message(self, msg_id_to_edit=None):
         msg = self.chat_entry.get();
@@ -213,253 +294,287 @@ class VortexTunnelApp(ctk.CTkFrame):
         cmd = "EDIT_MSG" if msg_id_to_edit else "CHAT_MSG"
         msg_id = msg_id_to_edit if msg_id_to_edit else str(uuid.uuid4())
         full_command = f"{cmd}:{msg_id}:{self.my_name}:{msg}"
-        self.send_command(full_command); self.process_command(full_command)
+        self.session.send_command(full_command); self.process_command(full_command)
         self.chat_entry.delete(0, tk.END)
         if msg_id_to_edit: self.send_button.configure(text="Send", command=self.send_chat_message)
 
     def edit_chat_prompt(self, msg_id):
-        frame = self.chat_messages[msg_id].winfo_children()[0]
-        original_text = frame.winfo_children()[1].cget("text")
+        original_text = self.chat_list.get(msg_id)["text"]
         self.chat_entry.delete(0, tk.END); self.chat_entry.insert(0, original_text)
         self.send_button.configure(text="Save", command=lambda: self.send_chat_message(msg_id_to_edit=msg_id))
 
     def confirm_clear_chat(self):
-        if messagebox.askyesno("Confirm", "Are you sure you want to clear the chat history for everyone?"): self.send_command("CLEAR_CHAT")
+        if messagebox.askyesno("Confirm", "Are you sure you want to clear the chat history for everyone?"): self.session.send_command("CLEAR_CHAT")
 
     def add_file_to_gallery(self, file_id, filename, filepath):
-        if file_id in self.file_gallery_items: return
-        frame = ctk.CTkFrame(self.gallery_frame); frame.pack(fill="x", padx=5, pady=5, anchor="w")
-        try:
-            img = Image.open(filepath); img.thumbnail((64,64)); thumb_img = ImageTk.PhotoImage(img)
-            img_label = ctk.CTkLabel(frame, image=thumb_img, text=""); img_label.image = thumb_img; img_label.pack(side="left", padx=5, pady=5)
-        except: ctk.CTkLabel(frame, text="FILE", width=64, height=64, fg_color="gray25", corner_radius=6).pack(side="left", padx=5, pady=5)
-        info_text = f"{filename}\nType: {os.path.splitext(filename)[1].upper()[1:] or 'Unknown'}\nSize: {os.path.getsize(filepath) / (1024*1024):.2f} MB"
-        Tooltip(frame, info_text)
-        ctk.CTkLabel(frame, text=filename, wraplength=self.winfo_width() - 200).pack(side="left", expand=True, fill="x", padx=5)
-        ctk.CTkButton(frame, text="Download", command=lambda id=file_id, name=filename: self.request_file_download(id, name)).pack(side="right", padx=5)
-        self.file_gallery_items[file_id] = frame
+        # Size and thumbnail arrive from the thumbnail pool once the row is first shown.
+        if "Files" in self.unbuilt_tabs: return
+        if file_id in self.gallery_list:
+            # A new path (the file was downloaded since) gets a fresh size and thumbnail.
+            record = self.gallery_list.get(file_id)
+            if record["path"] != filepath: self.gallery_thumbs.pop(file_id, None); self.gallery_list.update(file_id, dict(record, path=filepath, size=None))
+            return
+        self.gallery_list.append(file_id, {"filename": filename, "path": filepath, "size": None})
+
+    def _make_gallery_row(self, parent):
+        row = ctk.CTkFrame(parent, fg_color="transparent")
+        row.card = ctk.CTkFrame(row); row.card.pack(fill="x", padx=5, pady=5, anchor="w")
+        row.thumb = ctk.CTkLabel(row.card, text="")
+        row.placeholder = ctk.CTkLabel(row.card, text="FILE", width=64, height=64, fg_color="gray25", corner_radius=6)
+        row.name = ctk.CTkLabel(row.card, text=""); row.name.pack(side="left", expand=True, fill="x", padx=5)
+        row.download = ctk.CTkButton(row.card, text="Download"); row.download.pack(side="right", padx=5)
+        row.tooltip = Tooltip(row.card, "")
+        return row
+
+    def _bind_gallery_row(self, row, file_id, record):
+        filename = record["filename"]
+        if file_id not in self.gallery_thumbs:
+            self.gallery_thumbs[file_id] = None
+            path = record["path"]
+            self.thumbnails.request(path, lambda image, size: self.ui.post(self._thumbnail_ready, file_id, path, image, size))
+        thumb = self.gallery_thumbs[file_id]
+        shown, hidden = (row.thumb, row.placeholder) if thumb else (row.placeholder, row.thumb)
+        if thumb: row.thumb.configure(image=thumb)
+        hidden.pack_forget(); shown.pack(side="left", padx=5, pady=5, before=row.name)
+        size_text = f"{record['size'] / (1024*1024):.2f} MB" if record["size"] is not None else "..."
+        row.tooltip.text = f"{filename}\nType: {os.path.splitext(filename)[1].upper()[1:] or 'Unknown'}\nSize: {size_text}"
+        row.name.configure(text=filename, wraplength=self.winfo_width() - 200)
+        row.download.configure(command=lambda: self.request_file_download(file_id, filename))
+
+    def _thumbnail_ready(self, file_id, path, image, size):
+        from PIL import ImageTk
+        record = self.gallery_list.get(file_id)
+        # A result for a path the row no longer shows is dropped; the new path has its own request.
+        if record is None or record["path"] != path: return
+        self.gallery_thumbs[file_id] = ImageTk.PhotoImage(image) if image is not None else None
+        self.gallery_list.update(file_id, dict(record, size=size))
 
     def send_file(self, filepath):
         if not filepath or not os.path.exists(filepath): return
-        self.update_status(f"Requesting to send {os.path.basename(filepath)}...", "orange")
-        filename, filesize = os.path.basename(filepath), os.path.getsize(filepath)
-        file_id = str(uuid.uuid4())
-        
-        self.pending_transfers[file_id] = {"filepath": filepath}
-        self.send_command(f"FILE_REQUEST:{file_id}:{filename}:{filesize}")
-
-    def _send_file_data(self, file_id):
-        if file_id not in self.pending_transfers: return
-        filepath = self.pending_transfers[file_id]['filepath']
-        try:
-            self.send_command(f"FILE_START_TRANSFER:{file_id}:{os.path.basename(filepath)}:{os.path.getsize(filepath)}")
-            with open(filepath, 'rb') as f:
-                while chunk := f.read(8192): self.connection.sendall(chunk)
-            self.update_status(f"Successfully sent {os.path.basename(filepath)}", "green")
-        except Exception as e: print(f"Error sending file data: {e}"); self.update_status(f"Failed to send file", "red")
-        finally: 
-            if file_id in self.pending_transfers:
-                del self.pending_transfers[file_id]
+        self.session.send_file(filepath)
 
     def request_file_download(self, file_id, filename):
         save_path = filedialog.asksaveasfilename(initialfile=filename, title="Save File As")
-        if save_path:
-            self.pending_transfers[file_id] = {"save_path": save_path}
-            self.send_command(f"REQUEST_DOWNLOAD:{file_id}")
+        if save_path: self.session.request_download(file_id, save_path)
 
-    def load_config_and_history(self):
+    def load_config(self):
         try:
             if os.path.exists(self.config_file):
                 with open(self.config_file, 'r') as f: config = json.load(f)
-                last_profile = config.get("last_profile")
-                if last_profile and last_profile != "Select Profile":
-                    self.profile_menu.set(last_profile); self.profile_selected(last_profile)
-                    if messagebox.askyesno("Vortex Tunnel", f"Connect to {self.peer_name} at {self.ip_entry.get()}?"): self.connect_to_peer()
-            if os.path.exists(self.chat_history_file):
-                with open(self.chat_history_file, 'r') as f:
-                    for line in f: self.process_command(line.strip(), from_history=True)
+                last_profile, self.session.striped_transfers = config.get("last_profile"), config.get("striped_transfers", False)
+                self.custom_name, self.session.hub_mode = config.get("custom_name"), config.get("hub_mode", False)
+                self.record_metrics = config.get("record_metrics", False)
+                self.session.relay_max_size = config.get("relay_max_mb", self.session.relay_max_size // (1024 * 1024)) * 1024 * 1024
+                if last_profile and last_profile != "Select Profile": self.profile_menu.set(last_profile); self.profile_selected(last_profile, prompt=False)
         except Exception as e: print(f"Error loading config: {e}")
 
+    # --- Startup ---
+    # Phase times are seconds since the interpreter reached the top of this module, kept as
+    # startup.* gauges (so they appear in the stats panel and the metrics log) and printed once.
+    def _startup_phase(self, phase, at=None): self.metrics.gauge(f"startup.{phase}", round((at or time.perf_counter()) - STARTED, 4))
+
+    def _first_frame(self, event):
+        if self.first_frame_shown: return
+        self.first_frame_shown = True; self.update_idletasks(); self._startup_phase("first_frame")
+        self.after(1, self._after_first_frame)
+
+    def _after_first_frame(self):
+        # History loads behind the reconnect prompt rather than waiting for it to be answered.
+        threading.Thread(target=self._read_history, daemon=True).start()
+        if self.ip_entry.get() and self.peer_name and messagebox.askyesno("Vortex Tunnel", f"Connect to {self.peer_name} at {self.ip_entry.get()}?"): self.connect_to_peer()
+
+    def _read_history(self):
+        # Off the Tk thread: the one-time log migration and the latest page of chat.
+        try:
+            if os.path.exists(self.chat_history_file):
+                self.message_store.migrate_log(self.chat_history_file, lambda file_id, filename: os.path.join(self.session.downloads_folder, f"{file_id}_{filename}"))
+            rows, gallery = self.message_store.recent(), self.message_store.files()
+        except Exception as e: print(f"Error loading history: {e}"); rows, gallery = [], []
+        self.ui.post(self._show_history, rows)
+        self.content_index.scan([self.session.downloads_folder] + [path for _, _, path in gallery if os.path.exists(path)])
+
+    def _show_history(self, rows):
+        # Messages that arrived while history was loading are already listed, below these.
+        self.chat_list.prepend([(msg_id, {"sender": sender, "text": message}) for _, msg_id, sender, message in rows if msg_id not in self.chat_list])
+        self.chat_list.scroll_to_end()
+        self.oldest_chat_seq = rows[0][0] if rows else None
+        self._startup_phase("history")
+
     def on_closing(self, force_close=False):
         if not force_close:
-            config = {"last_profile": self.profile_menu.get() if self.my_name else "Select Profile"}
+            config = {"last_profile": self.profile_menu.get() if self.my_name else "Select Profile", "striped_transfers": self.session.striped_transfers,
+                      "custom_name": self.custom_name, "hub_mode": self.session.hub_mode, "record_metrics": self.record_metrics,
+                      "relay_max_mb": self.session.relay_max_size // (1024 * 1024)}
             with open(self.config_file, 'w') as f: json.dump(config, f)
-        if self.connection: self.connection.close()
+        self.session.close()
         self.master.destroy()
         sys.exit()
 
-    def process_command(self, command_str, from_history=False):
+    def process_command(self, command_str): self.process_commands([(command_str, None)])
+
+    def process_commands(self, commands):
+        # One batch of (command, peer) pairs from the UI dispatcher (or a single local command, with
+        # no peer): each peer's drawing bursts are coalesced, chat history is written in one
+        # transaction and the user is notified once.
+        history = []
+        for peer, run in itertools.groupby(commands, key=lambda item: item[1]):
+            for command_str in coalesce([command_str for command_str, _ in run]):
+                started = time.perf_counter()
+                cmd = self._handle_command(command_str, peer)
+                self.metrics.observe(f"command.{cmd or 'failed'}", time.perf_counter() - started)
+                if cmd in CHAT_COMMANDS: history.append(command_str)
+        if history: self.message_store.apply(*history)
+        self.notify_user()
+
+    def _handle_command(self, command_str, peer=None):
         try:
             cmd = command_str.split(":", 1)[0]
-            if cmd == "CHAT_MSG": _, msg_id, sender, message = command_str.split(":", 3); self.add_chat_message(msg_id, sender, message, is_own=(sender == self.my_name))
-            elif cmd == "EDIT_MSG": _, msg_id, _, new_message = command_str.split(":", 3); self.chat_messages[msg_id].winfo_children()[0].winfo_children()[1].configure(text=new_message)
-            elif cmd == "DELETE_MSG": _, msg_id = command_str.split(":", 1); self.chat_messages[msg_id].destroy(); del self.chat_messages[msg_id]
-            elif cmd == "CLEAR_CHAT": [w.destroy() for w in self.chat_messages.values()]; self.chat_messages.clear()
-            elif cmd == "DRAW": _, coords = command_str.split(":", 1); x1, y1, x2, y2, color, size = coords.split(","); self.canvas.create_line(int(x1), int(y1), int(x2), int(y2), width=float(size), fill=color, capstyle=tk.ROUND, smooth=tk.TRUE)
-            elif cmd == "CLEAR": self.canvas.delete("all")
-            elif cmd == "FILE_REQUEST": _, file_id, filename, filesize = command_str.split(":", 3); FileAcceptDialog(self, filename, int(filesize), lambda accept: self.handle_file_decision(accept, file_id, filename, int(filesize)))
-            elif cmd == "FILE_ACCEPT": _, file_id = command_str.split(":", 1); threading.Thread(target=self._send_file_data, args=(file_id,), daemon=True).start()
-            elif cmd == "FILE_REJECT": self.update_status("File transfer rejected by peer.", "orange")
-            elif cmd == "ADD_TO_GALLERY": _, file_id, filename = command_str.split(":", 2); local_path = os.path.join(self.downloads_folder, f"{file_id}_{filename}"); self.add_file_to_gallery(file_id, filename, local_path)
-            elif cmd == "REQUEST_DOWNLOAD": _, file_id = command_str.split(":", 1); self._send_file_data(file_id)
-            elif cmd == "DELETE_FILE": _, file_id = command_str.split(":", 1); self.file_gallery_items[file_id].destroy(); del self.file_gallery_items[file_id]
-            elif cmd == "CLEAR_GALLERY": [w.destroy() for w in self.file_gallery_items.values()]; self.file_gallery_items.clear()
-            
-            if not from_history: self.notify_user()
-            if not from_history and cmd in ["CHAT_MSG", "EDIT_MSG", "DELETE_MSG", "CLEAR_CHAT", "ADD_TO_GALLERY"]:
-                with open(self.chat_history_file, 'a' if cmd != "CLEAR_CHAT" else 'w') as f:
-                    if cmd != "CLEAR_CHAT": f.write(command_str + '\n')
+            if cmd == "CHAT_MSG": _, msg_id, sender, message = command_str.split(":", 3); self.add_chat_message(msg_id, sender, message)
+            elif cmd == "EDIT_MSG": _, msg_id, sender, new_message = command_str.split(":", 3); self.chat_list.update(msg_id, {"sender": sender, "text": new_message})
+            elif cmd == "DELETE_MSG": _, msg_id = command_str.split(":", 1); self.chat_list.remove(msg_id)
+            elif cmd == "CLEAR_CHAT": self.chat_list.clear(); self.oldest_chat_seq = None
+            elif cmd == "DRAW": self._build_tab("Drawing"); *coords, color, size = command_str.split(":", 1)[1].split(","); self.canvas.create_line(*map(int, coords), width=float(size), fill=color, capstyle=tk.ROUND, smooth=tk.TRUE)
+            elif cmd in ("STROKE_BEGIN", "STROKE", "STROKE_END"): self._build_tab("Drawing"); self.stroke_canvas.apply(command_str)
+            elif cmd == "CLEAR":
+                # CLEAR carries the clearing peer's timestamp so both sides record the same epoch.
+                epoch = command_str.split(":", 1)[1] if ":" in command_str else None
+                if "Drawing" not in self.unbuilt_tabs: self.canvas.delete("all"); self.stroke_canvas.clear()
+                self.stroke_store.clear(float(epoch) if epoch else time.time())
+            elif cmd == "CANVAS_SYNC": _, state = command_str.split(":", 1); self._apply_canvas_sync(json.loads(state))
+            elif cmd == "FILE_REQUEST":
+                file_id, filename, filesize, digest = parse_file_request(command_str)
+                FileAcceptDialog(self, filename, filesize, lambda accept: self.handle_file_decision(accept, file_id, filename, filesize, digest, peer), known=bool(self.content_index.lookup(digest, filesize)))
+            elif cmd == "BATCH_REQUEST":
+                _, batch_id, summary = command_str.split(":", 2); summary = json.loads(summary)
+                BatchAcceptDialog(self, summary, lambda accept: self.handle_batch_decision(accept, batch_id, summary, peer))
+            elif cmd == "ADD_TO_GALLERY":
+                _, file_id, filename = command_str.split(":", 2); local_path = self.session.gallery_announced(file_id, filename)
+                if local_path: self.add_file_to_gallery(file_id, safe_filename(filename), local_path)
+            elif cmd == "DELETE_FILE":
+                _, file_id = command_str.split(":", 1); self.message_store.remove_file(file_id); self.gallery_thumbs.pop(file_id, None)
+                if "Files" not in self.unbuilt_tabs: self.gallery_list.remove(file_id)
+            elif cmd == "CLEAR_GALLERY":
+                self.message_store.remove_file(); self.gallery_thumbs.clear()
+                if "Files" not in self.unbuilt_tabs: self.gallery_list.clear()
+            return cmd
         except Exception as e: print(f"Error processing command: {e} -> '{command_str}'")
 
-    def handle_file_decision(self, accepted, file_id, filename, filesize):
-        if accepted: self.send_command(f"FILE_ACCEPT:{file_id}")
-        else: self.send_command(f"FILE_REJECT:{file_id}")
-
-    def receive_data(self):
-        buffer = b""
-        separator = b"\n"
-
-        while self.connected.is_set():
-            try:
-                # Read data from the socket
-                chunk = self.connection.recv(8192)
-                if not chunk:
-                    self.handle_disconnect()
-                    break
-                
-                buffer += chunk
-
-                # Process all newline-separated commands in the buffer
-                while separator in buffer:
-                    command_bytes, buffer = buffer.split(separator, 1)
-                    command_str = command_bytes.decode('utf-8', errors='ignore').strip()
-
-                    if not command_str:
-                        continue
-
-                    # Check if a file transfer is starting
-                    if command_str.startswith("FILE_START_TRANSFER"):
-                        try:
-                            # --- DEDICATED FILE RECEIVING LOGIC ---
-                            _, file_id, filename, filesize_str = command_str.split(":", 3)
-                            filesize = int(filesize_str)
-                            self.update_status(f"Receiving {filename}...", "orange")
-                            
-                            # Ask user where to save the file
-                            save_path = filedialog.asksaveasfilename(
-                                initialfile=filename,
-                                title=f"Save Received File: {filename}"
-                            )
-
-                            if not save_path:
-                                # User cancelled. We must discard the incoming file data to keep the connection synced.
-                                self.update_status(f"Cancelled receiving {filename}", "orange")
-                                bytes_to_discard = filesize
-                                # Discard any data already in the buffer
-                                if len(buffer) > 0:
-                                    discarded_now = min(len(buffer), bytes_to_discard)
-                                    buffer = buffer[discarded_now:]
-                                    bytes_to_discard -= discarded_now
-                                # Discard the rest from the socket
-                                while bytes_to_discard > 0:
-                                    discard_chunk = self.connection.recv(min(8192, bytes_to_discard))
-                                    if not discard_chunk:
-                                        self.handle_disconnect()
-                                        return
-                                    bytes_to_discard -= len(discard_chunk)
-                                continue # Go back to processing commands
-
-                            # User accepted, receive the file in a dedicated loop
-                            bytes_received = 0
-                            with open(save_path, 'wb') as f:
-                                # First, write any file data that was already in our buffer
-                                if len(buffer) > 0:
-                                    data_to_write = buffer[:filesize]
-                                    f.write(data_to_write)
-                                    bytes_received += len(data_to_write)
-                                    buffer = buffer[filesize:] # Keep any data that came after the file
-
-                                # Now, receive the rest of the file from the socket
-                                while bytes_received < filesize:
-                                    remaining = filesize - bytes_received
-                                    file_chunk = self.connection.recv(min(8192, remaining))
-                                    if not file_chunk:
-                                        self.handle_disconnect()
-                                        return
-                                    f.write(file_chunk)
-                                    bytes_received += len(file_chunk)
-                            
-                            # --- FILE TRANSFER COMPLETE ---
-                            self.update_status(f"Successfully received {filename}", "green")
-                            self.send_command(f"ADD_TO_GALLERY:{file_id}:{filename}")
-                            self.add_file_to_gallery(file_id, filename, save_path)
-
-                        except Exception as e:
-                            print(f"Error during file transfer: {e}")
-                            self.update_status("File transfer failed.", "red")
-                            # If something went wrong, the connection state is unknown, so it's safest to disconnect
-                            self.handle_disconnect()
-                            break
-                    
-                    else:
-                        # It's a regular command, process it
-                        self.process_command(command_str)
-
-            except Exception as e:
-                print(f"Receive loop error: {e}")
-                self.handle_disconnect()
-                break
-
-    def send_command(self, data_str):
-        if self.connection and self.connected.is_set():
-            try: self.connection.sendall((data_str + "\n").encode('utf-8'))
-            except Exception: self.handle_disconnect()
+    def handle_file_decision(self, accepted, file_id, filename, filesize, digest, peer):
+        # Ask where to save up front, on the UI thread, so the receive loop never blocks on a dialog.
+        save_path = filedialog.asksaveasfilename(initialfile=filename, title=f"Save Received File: {filename}") if accepted else None
+        if save_path: self.session.accept_file(file_id, filename, filesize, digest, save_path, peer)
+        else: self.session.reject_file(file_id, peer)
+
+    def handle_batch_decision(self, accepted, batch_id, summary, peer):
+        dest = filedialog.askdirectory(title="Save Received Files In") if accepted else None
+        if dest: self.session.accept_batch(batch_id, summary, dest, peer)
+        else: self.session.reject_batch(batch_id, peer)
+
+    def start_stroke(self, event):
+        # Motion events only grow the local stroke; the peer receives simplified batches on a timer.
+        self.active_stroke = StrokeBuilder(self.color, self.brush_size, event.x, event.y)
+        self.stroke_canvas.begin(self.active_stroke.id, self.color, self.brush_size, [(event.x, event.y)])
+        self.after(FLUSH_INTERVAL_MS, self._flush_stroke, self.active_stroke)
 
     def draw(self, event):
-        if self.old_x is not None:
-            full_command = f"DRAW:{self.old_x},{self.old_y},{event.x},{event.y},{self.color},{self.brush_size}"
-            self.send_command(full_command); self.process_command(full_command)
-        self.old_x, self.old_y = event.x, event.y
-
-    def reset_drawing_state(self, event): self.old_x, self.old_y = None, None
-    def clear_canvas(self): self.send_command("CLEAR"); self.process_command("CLEAR")
-    def profile_selected(self, selection):
+        if not self.active_stroke: return
+        if self.active_stroke.add(event.x, event.y): self._send_stroke_batch(self.active_stroke)
+        self.stroke_canvas.extend(self.active_stroke.id, [(event.x, event.y)])
+
+    def _flush_stroke(self, stroke):
+        if stroke is not self.active_stroke: return
+        self._send_stroke_batch(stroke); self.after(FLUSH_INTERVAL_MS, self._flush_stroke, stroke)
+
+    def _send_stroke_batch(self, stroke):
+        command = stroke.flush()
+        if command: self.session.send_command(command)
+
+    def reset_drawing_state(self, event):
+        stroke, self.active_stroke = self.active_stroke, None
+        if not stroke: return
+        self._send_stroke_batch(stroke); self.session.send_command(f"STROKE_END:{stroke.id}")
+        # Show exactly the simplified polyline the peer drew, not the raw motion points.
+        self.stroke_canvas.replace(stroke.id, stroke.sent); self.stroke_canvas.end(stroke.id)
+
+    def clear_canvas(self): command = f"CLEAR:{time.time()}"; self.session.send_command(command); self.process_command(command)
+
+    def _stroke_completed(self, stroke):
+        if self.stroke_store.add(stroke): self._compact_canvas()
+
+    def _compact_canvas(self):
+        # Finished strokes are folded into the snapshot image, so canvas items stay bounded too.
+        self.stroke_canvas.remove(self.stroke_store.compact()); self._show_canvas_snapshot()
+
+    def _show_canvas_snapshot(self):
+        from PIL import ImageTk
+        self.canvas.delete("snapshot")
+        if self.stroke_store.snapshot is None: self.canvas_snapshot = None; return
+        self.canvas_snapshot = ImageTk.PhotoImage(self.stroke_store.snapshot)
+        self.canvas.create_image(0, 0, anchor="nw", image=self.canvas_snapshot, tags="snapshot"); self.canvas.tag_lower("snapshot")
+
+    def _show_canvas_state(self):
+        self.canvas.delete("all"); self.stroke_canvas.clear(); self._show_canvas_snapshot()
+        for stroke in self.stroke_store.log: self.stroke_canvas.draw(stroke)
+
+    def _apply_canvas_sync(self, peer_state):
+        # The peer's snapshot plus its strokes since then; see StrokeStore.merge for who wins.
+        outcome, new_strokes = self.stroke_store.merge(peer_state)
+        # Before the Drawing tab exists the store is the whole state; the tab draws it when built.
+        if "Drawing" in self.unbuilt_tabs:
+            if len(self.stroke_store.log) >= StrokeStore.SNAPSHOT_EVERY: self.stroke_store.compact()
+            return
+        if outcome == "replace": self._show_canvas_state()
+        elif outcome == "merge":
+            self._show_canvas_snapshot()
+            for stroke in new_strokes: self.stroke_canvas.draw(stroke)
+            if len(self.stroke_store.log) >= StrokeStore.SNAPSHOT_EVERY: self._compact_canvas()
+    def profile_selected(self, selection, prompt=True):
         if f"I am {self.NATHAN_NAME}" in selection: self.my_name, self.peer_name, target_ip = self.NATHAN_NAME, self.MAJID_NAME, self.MAJID_IP
         elif f"I am {self.MAJID_NAME}" in selection: self.my_name, self.peer_name, target_ip = self.MAJID_NAME, self.NATHAN_NAME, self.NATHAN_IP
-        else: self.my_name, self.peer_name = None, None; return
-        self.ip_entry.delete(0, tk.END); self.ip_entry.insert(0, target_ip)
+        elif selection == self.CUSTOM_PROFILE:
+            # Any other member of a group session; names end up in chat commands, so no colons.
+            name = ctk.CTkInputDialog(text="Your name:", title="Profile").get_input() if prompt or not self.custom_name else self.custom_name
+            name = (name or "").replace(":", "").strip()
+            if not name: self.profile_menu.set("Select Profile"); name = None
+            self.my_name, self.peer_name, self.custom_name = name, None, name or self.custom_name
+        else: self.my_name, self.peer_name = None, None
+        # The session introduces us by this name in the HELLO of every new connection.
+        self.session.name = self.my_name
+        if self.peer_name: self.ip_entry.delete(0, tk.END); self.ip_entry.insert(0, target_ip)
 
     def connect_to_peer(self):
         peer_ip = self.ip_entry.get()
         if not peer_ip: messagebox.showerror("Error", "IP address is required."); return
         if not self.my_name: messagebox.showerror("Error", "Please select your profile first."); return
-        threading.Thread(target=self._connect_thread, args=(peer_ip,), daemon=True).start()
-
-    def _connect_thread(self, peer_ip):
-        try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM); client_socket.connect((peer_ip, self.port))
-            self.connection = client_socket; self.connected.set()
-            self.update_status(f"Connected to {self.peer_name} ({peer_ip})", "green")
-            threading.Thread(target=self.receive_data, daemon=True).start()
-        except Exception as e: self.update_status(f"Connection failed: {e}", "red")
-
-    def start_server(self): threading.Thread(target=self._server_thread, daemon=True).start()
-    def _server_thread(self):
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM); server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try: server.bind((self.host_ip_listen, self.port)); server.listen(1)
-        except Exception: return
-        if not self.connected.is_set():
-            try:
-                conn, addr = server.accept(); self.connection = conn; self.connected.set()
-                self.update_status(f"Connected by {addr[0]}", "green"); threading.Thread(target=self.receive_data, daemon=True).start()
-            except OSError: pass
-
-    def update_status(self, message, color): self.status_label.configure(text=message, text_color=color)
-    def handle_disconnect(self):
-        if not self.connected.is_set(): return
-        self.connected.clear();
-        if self.connection: self.connection.close(); self.connection = None
-        self.update_status("Status: Disconnected", "red"); self.start_server()
+        self.session.connect(peer_ip)
+
+    def start_server(self):
+        try: self.session.listen()
+        except OSError as e: self.update_status(f"Could not listen on port {self.session.port}: {e}", "red")
+
+    def _peer_changed(self, peer, joined):
+        # A new peer gets our drawing state; its own arrives as a CANVAS_SYNC command.
+        if joined: self.session.send_command(f"CANVAS_SYNC:{self.stroke_store.sync_payload()}", peer)
+        self._show_peers()
+
+    def _show_peers(self):
+        peers = [f"{peer.name} ({peer.conn.peer})" for peer in self.session.hub]
+        if self.session.hub_mode: self.update_status(f"Hosting {len(peers)} peer(s): {', '.join(peers)}" if peers else f"Hosting on port {self.session.port}", "green")
+        elif peers: self.update_status(f"Connected to {peers[0]}", "green")
+        else: self.update_status("Status: Disconnected", "red")
+
+    def update_status(self, message, color): self.ui.call(self.status_label.configure, text=message, text_color=color)
+    def _sample_metrics(self, due):
+        # Once a second: how late this Tk callback ran, the UI queue depth, transfer rates (also
+        # shown in the status bar) and, when enabled, a line of the JSON lines log.
+        self.metrics.observe("ui_lag", max(0.0, time.monotonic() - due)); self.metrics.gauge("ui_queue", len(self.ui))
+        self.metrics.sample()
+        transfers = self.metrics.snapshot()["transfers"]
+        if transfers: self.update_status(format_transfer(transfers[0]) + (f" (+{len(transfers) - 1} more)" if len(transfers) > 1 else ""), "orange")
+        if self.record_metrics:
+            try: self.metrics.export(self.metrics_file)
+            except OSError as e: print(f"Error writing metrics: {e}"); self.record_metrics = False
+        self.after(SAMPLE_INTERVAL_MS, self._sample_metrics, time.monotonic() + SAMPLE_INTERVAL_MS / 1000)
 
     def notify_user(self):
         if self.master.state() == 'iconic' or not self.master.focus_get():
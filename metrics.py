@@ -0,0 +1,128 @@
+import bisect
+import json
+import threading
+import time
+
+# --- Metrics ---
+# Counters, latency histograms, gauges and live transfers, cheap enough to update on every
+# command. Transfers are not updated per chunk: each registers a progress callable that is
+# polled by sample(), which also turns the deltas into a smoothed rate and an ETA. snapshot()
+# returns everything as plain JSON-ready data; export() appends it as one JSON line.
+BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # seconds
+RATE_SMOOTHING = 0.3
+SAMPLE_INTERVAL_MS = 1000
+PING_INTERVAL_MS = 5000
+
+
+class Histogram:
+    # Fixed buckets (BOUNDS plus overflow); percentiles are reported as a bucket's upper bound.
+    def __init__(self):
+        self.buckets, self.count, self.total, self.max = [0] * (len(BOUNDS) + 1), 0, 0.0, 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(BOUNDS, value)] += 1
+        self.count += 1; self.total += value; self.max = max(self.max, value)
+
+    def percentile(self, p):
+        rank, seen = p * self.count, 0
+        for bound, n in zip(BOUNDS + (self.max,), self.buckets):
+            seen += n
+            if n and seen >= rank: return min(bound, self.max)
+        return 0.0
+
+    def snapshot(self):
+        return {"count": self.count, "mean": self.total / self.count if self.count else 0.0, "max": self.max,
+                "p50": self.percentile(0.5), "p95": self.percentile(0.95), "buckets": list(self.buckets)}
+
+
+class Transfer:
+    def __init__(self, name, direction, total, progress):
+        self.name, self.direction, self.total, self.progress = name, direction, total, progress
+        self.done, self.rate, self.sampled_at = progress(), 0.0, time.monotonic()
+
+    def sample(self, now):
+        done = self.progress()
+        if now > self.sampled_at:
+            rate = (done - self.done) / (now - self.sampled_at)
+            self.rate = rate if not self.rate else (1 - RATE_SMOOTHING) * self.rate + RATE_SMOOTHING * rate
+        self.done, self.sampled_at = done, now
+
+    def snapshot(self):
+        eta = (self.total - self.done) / self.rate if self.rate > 0 else None
+        return {"name": self.name, "direction": self.direction, "total": self.total, "done": self.done, "rate": self.rate, "eta": eta}
+
+
+class Metrics:
+    def __init__(self):
+        self.lock, self.started = threading.Lock(), time.time()
+        self.counters, self.histograms, self.gauges, self.transfers = {}, {}, {}, {}
+
+    def count(self, name, n=1):
+        with self.lock: self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None: histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def gauge(self, name, value):
+        # Keeps the latest value and the peak since startup.
+        with self.lock: self.gauges[name] = {"value": value, "peak": max(value, self.gauges.get(name, {}).get("peak", value))}
+
+    def transfer_started(self, key, name, direction, total, progress):
+        # `progress()` returns the bytes done so far; it is called from sample().
+        with self.lock: self.transfers[key] = Transfer(name, direction, total, progress)
+
+    def transfer_finished(self, key):
+        with self.lock: self.transfers.pop(key, None)
+
+    def sample(self):
+        now = time.monotonic()
+        with self.lock: transfers = list(self.transfers.values())
+        for transfer in transfers: transfer.sample(now)
+
+    def watch_loop(self, loop, name, interval=0.5):
+        # Lag of an asyncio loop: how late a callback scheduled every `interval` actually runs.
+        def tick(due):
+            self.observe(name, max(0.0, loop.time() - due))
+            loop.call_later(interval, tick, loop.time() + interval)
+        loop.call_soon_threadsafe(lambda: loop.call_later(interval, tick, loop.time() + interval))
+
+    def snapshot(self):
+        with self.lock:
+            return {"time": time.time(), "uptime": time.time() - self.started, "counters": dict(self.counters),
+                    "gauges": {name: dict(gauge) for name, gauge in self.gauges.items()},
+                    "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+                    "transfers": [transfer.snapshot() for transfer in self.transfers.values()]}
+
+    def export(self, path):
+        with open(path, 'a') as f: f.write(json.dumps(self.snapshot()) + '\n')
+
+
+def format_duration(seconds):
+    if seconds is None: return "--"
+    minutes, seconds = divmod(int(seconds), 60); hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+
+def format_transfer(transfer):
+    percent = 100 * transfer["done"] / transfer["total"] if transfer["total"] else 100
+    verb = "Sending" if transfer["direction"] == "out" else "Receiving"
+    return f"{verb} {transfer['name']}: {percent:.0f}% at {transfer['rate'] / (1024 * 1024):.1f} MB/s, ETA {format_duration(transfer['eta'])}"
+
+
+def format_report(snapshot):
+    # The plain-text view of a snapshot shown in the settings stats panel.
+    ms = lambda seconds: f"{seconds * 1000:.1f} ms"
+    lines = [format_transfer(transfer) for transfer in snapshot["transfers"]] or ["No transfers in progress"]
+    lines.append("")
+    for name, gauge in sorted(snapshot["gauges"].items()): lines.append(f"{name}: {gauge['value']:g} (peak {gauge['peak']:g})")
+    histograms = snapshot["histograms"]
+    for name in sorted(n for n in histograms if not n.startswith("command.")):
+        h = histograms[name]; lines.append(f"{name}: p50 {ms(h['p50'])}, p95 {ms(h['p95'])}, max {ms(h['max'])} ({h['count']} samples)")
+    lines += ["", "Commands (count, mean, p95):"]
+    for name in sorted(n for n in histograms if n.startswith("command.")):
+        h = histograms[name]; lines.append(f"  {name[8:]}: {h['count']}, {ms(h['mean'])}, {ms(h['p95'])}")
+    for name, value in sorted(snapshot["counters"].items()): lines.append(f"{name}: {value}")
+    return "\n".join(lines)
@@ -0,0 +1,173 @@
+import asyncio
+import collections
+import threading
+import time
+import protocol
+
+# --- Channel Multiplexer ---
+# A single writer coroutine on the network loop owns the connection. Commands go on the
+# control queue and are always written first; file data is split into bounded chunks on
+# per-transfer channels that are served round-robin, each limited by the credit window its
+# receiver has granted. Producers are ordinary threads and block while a channel's queue is
+# full; the writer itself waits on the transport's write buffer, so a slow peer holds back
+# file data rather than growing memory.
+# Chunks are either bytes or FileRegions, which are read from disk on the engine's read executor
+# only when their turn comes, so queued regions cost no memory. While one chunk drains to the
+# socket, the channel's next region is already being read, so the disk and the link overlap.
+# A region on the only channel with data queued is instead sent zero-copy with the loop's
+# sendfile, as long as the measured rate gets it out within SENDFILE_MAX_DELAY: nothing else can
+# be written meanwhile, so commands wait at most that long behind it.
+CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 2 * 1024 * 1024
+INITIAL_WINDOW = 4 * MAX_CHUNK_SIZE
+CHANNEL_QUEUE_CHUNKS = 4
+SENDFILE_MAX_DELAY = 0.1
+
+
+class FileRegion:
+    __slots__ = ("file", "offset", "count")
+
+    def __init__(self, file, offset, count): self.file, self.offset, self.count = file, offset, count
+    def __len__(self): return self.count
+
+
+class ChannelClosed(Exception):
+    pass
+
+
+class OutgoingChannel:
+    def __init__(self, mux, channel_id, window):
+        self.mux, self.id, self.window = mux, channel_id, window
+        self.queue, self.finished, self.pending = collections.deque(), False, 0
+        self.queued = 0  # file bytes handed to the channel, for progress reporting
+
+    def write(self, data, offset):
+        for i in range(0, len(data), MAX_CHUNK_SIZE):
+            self.mux._enqueue(self, offset + i, data if len(data) <= MAX_CHUNK_SIZE else data[i:i + MAX_CHUNK_SIZE])
+        self.queued += len(data)
+
+    def write_compressed(self, packed, offset, size): self.mux._enqueue(self, offset, packed, protocol.FLAG_ZLIB); self.queued += size
+    def write_region(self, file, offset, count): self.mux._enqueue(self, offset, FileRegion(file, offset, count)); self.queued += count
+
+    def close(self): self.mux._finish(self)
+
+    def wait_drained(self):
+        with self.mux._cond:
+            while self.pending and not self.mux._closed: self.mux._cond.wait()
+            if self.pending: raise ChannelClosed()
+
+
+def _read_region(region):
+    region.file.seek(region.offset)
+    data = region.file.read(region.count)
+    if len(data) != region.count: raise OSError("Source file shrank during transfer")
+    return data
+
+
+class Multiplexer:
+    def __init__(self, conn, on_error, flow_control=True):
+        # conn is a net.Connection; its engine's loop runs the writer.
+        self.conn, self.on_error, self.flow_control = conn, on_error, flow_control
+        self.loop, self.executor = conn.engine.loop, conn.engine.read_executor
+        self._cond, self._wake = threading.Condition(), asyncio.Event()
+        self._control, self._channels = collections.deque(), collections.OrderedDict()
+        self._next_id, self._closed, self.backlog = 1, False, 0  # backlog: bytes of queued commands
+        self.throughput = 0.0  # EWMA of data bytes/sec drained to the socket
+        self._reads = {}  # FileRegion -> executor future reading it ahead of its turn
+        self.writer = asyncio.run_coroutine_threadsafe(self._writer(), self.loop)  # done once the writer has stopped
+
+    def _notify(self):
+        # Called with _cond held: wakes blocked producers and the writer coroutine.
+        self._cond.notify_all(); self.loop.call_soon_threadsafe(self._wake.set)
+
+    def send(self, frame_bytes):
+        with self._cond:
+            if self._closed: return False
+            self._control.append(frame_bytes); self.backlog += len(frame_bytes); self._notify()
+        return True
+
+    def open_channel(self):
+        with self._cond:
+            if self._closed: raise ChannelClosed()
+            while self._next_id in self._channels: self._next_id = self._next_id % 0xFFFF + 1
+            channel = OutgoingChannel(self, self._next_id, INITIAL_WINDOW if self.flow_control else float("inf"))
+            self._channels[channel.id] = channel
+            self._next_id = self._next_id % 0xFFFF + 1
+            return channel
+
+    def grant(self, channel_id, nbytes):
+        with self._cond:
+            channel = self._channels.get(channel_id)
+            if channel: channel.window += nbytes; self._notify()
+
+    def close(self):
+        with self._cond: self._closed = True; self._notify()
+
+    def _enqueue(self, channel, offset, payload, flags=0):
+        with self._cond:
+            while not self._closed and len(channel.queue) >= CHANNEL_QUEUE_CHUNKS: self._cond.wait()
+            if self._closed: raise ChannelClosed()
+            channel.queue.append((offset, payload, flags)); channel.pending += 1; self._notify()
+
+    def _finish(self, channel):
+        with self._cond:
+            channel.finished = True
+            if not channel.queue: self._channels.pop(channel.id, None)
+
+    def _next_item(self):
+        if self._control: item = self._control.popleft(); self.backlog -= len(item); return item
+        for channel_id, channel in self._channels.items():
+            if channel.queue and channel.window >= len(channel.queue[0][1]):
+                offset, payload, flags = channel.queue.popleft(); channel.window -= len(payload)
+                if channel.finished and not channel.queue: del self._channels[channel_id]
+                else: self._channels.move_to_end(channel_id)
+                return channel, offset, payload, flags
+        return None
+
+    def _read(self, region):
+        future = self._reads.pop(region, None)
+        if future is None:
+            future = self.loop.run_in_executor(self.executor, _read_region, region)
+            # A read ahead that nobody awaits (the channel was closed) must not log its error.
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return future
+
+    def _zero_copy(self, channel, region):
+        # Not for a region whose read has already started: that read also moves the file position.
+        with self._cond: alone = not any(other.queue for other in self._channels.values() if other is not channel)
+        return alone and region not in self._reads and self.throughput * SENDFILE_MAX_DELAY >= region.count
+
+    async def _write_data(self, channel, offset, payload, flags):
+        started, size, header = time.perf_counter(), len(payload), protocol.encode_data_header(channel.id, offset, len(payload), flags)
+        if isinstance(payload, FileRegion) and self._zero_copy(channel, payload):
+            self.conn.write(header)
+            if await self.conn.sendfile(payload.file, payload.offset, size) != size: raise OSError("Source file shrank during transfer")
+        else:
+            if isinstance(payload, FileRegion): payload = await self._read(payload)
+            self.conn.write(header); self.conn.write(payload)
+        with self._cond: upcoming = channel.queue[0][1] if channel.queue else None
+        if isinstance(upcoming, FileRegion) and upcoming not in self._reads and not self._zero_copy(channel, upcoming): self._reads[upcoming] = self._read(upcoming)
+        await self.conn.drain()
+        # With the write buffer capped, the time to get back under its low-water mark tracks
+        # the rate the link actually accepts data.
+        elapsed = time.perf_counter() - started
+        if elapsed > 0: self.throughput = size / elapsed if not self.throughput else 0.8 * self.throughput + 0.2 * size / elapsed
+        with self._cond: channel.pending -= 1; self._cond.notify_all()
+
+    async def _writer(self):
+        try:
+            while True:
+                with self._cond:
+                    if self._closed: return
+                    item = self._next_item()
+                    if item is None: self._wake.clear()
+                    else: self._cond.notify_all()
+                if item is None: await self._wake.wait()
+                elif isinstance(item, tuple): await self._write_data(*item)
+                else: self.conn.write(item); await self.conn.drain()
+        except (OSError, ConnectionError):
+            if not self._closed: self.on_error()
+        finally:
+            # Wake producers and wait_drained() callers if the writer stopped on an error.
+            with self._cond: self._closed = True; self._cond.notify_all()
+            self._reads.clear()
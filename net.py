@@ -0,0 +1,161 @@
+import asyncio
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import protocol
+from protocol import FrameReader, FRAME_HELLO, ProtocolError
+
+# --- Network Engine ---
+# Every socket is owned by one asyncio loop running in a background thread: the listener,
+# outgoing connections (retried with exponential backoff), reading and writing. Callbacks run
+# on the loop thread, so anything that touches Tk must go through the UI dispatcher. Blocking
+# work such as reading and hashing files runs on a small executor, not on the loop. The
+# multiplexers' file reads have an executor of their own: transfers block in run_blocking
+# until their channel drains, and draining needs those reads, so sharing one pool could
+# leave every worker waiting on a read that never gets a thread.
+HANDSHAKE_TIMEOUT = 10
+RECONNECT_MIN, RECONNECT_MAX = 1.0, 30.0
+WRITE_HIGH_WATER, WRITE_LOW_WATER = 256 * 1024, 64 * 1024
+BLOCKING_WORKERS = 8
+READ_WORKERS = 4
+
+
+class Connection(asyncio.BufferedProtocol):
+    # One TCP connection. Bytes are received straight into the FrameReader's buffer, or a DATA
+    # frame's sink, through get_buffer/buffer_updated, asyncio's counterpart of recv_into.
+    # Both sides send HELLO on connect. Once the peer's HELLO arrives, `engine.on_connection`
+    # is called synchronously and must set `on_frame` (or call hold()) before any later frame
+    # is parsed. `session` is the connection this one belongs to: itself, or for a stripe the
+    # session it carries data for.
+    def __init__(self, engine, hello, outbound=False):
+        self.engine, self.hello, self.outbound, self.session = engine, hello, outbound, self
+        self.reader = FrameReader(sink=(lambda channel, offset, size: engine.sink(self.session, channel, offset, size)) if engine.sink else None)
+        self.transport = self.peer = self.info = self.on_frame = self.on_close = None
+        self.handshake, self.held, self.closed = engine.loop.create_future(), False, False
+        self._writable, self._started = asyncio.Event(), None
+        self._writable.set()
+
+    def connection_made(self, transport):
+        self.transport, self.peer = transport, transport.get_extra_info("peername")[0]
+        sock = transport.get_extra_info("socket")
+        if sock is not None: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport.set_write_buffer_limits(WRITE_HIGH_WATER, WRITE_LOW_WATER)
+        self._started = time.perf_counter()
+        transport.write(protocol.encode_hello(**self.hello))
+        self.engine.loop.call_later(HANDSHAKE_TIMEOUT, self._handshake_timeout)
+
+    def _handshake_timeout(self):
+        if self.info is None and not self.closed: self._handshake_failed(ProtocolError("Peer did not complete the handshake")); self.transport.close()
+
+    def _handshake_failed(self, exc):
+        # Only outbound connections await the handshake; for inbound ones the error is marked
+        # retrieved here so asyncio does not log it as unhandled.
+        if not self.handshake.done(): self.handshake.set_exception(exc); self.handshake.exception()
+
+    def get_buffer(self, sizehint): return self.reader.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.reader.buffer_updated(nbytes)
+        self._dispatch()
+
+    def _dispatch(self):
+        try:
+            for frame in self.reader.frames():
+                if self.info is None: self._hello(frame)
+                elif self.on_frame: self._deliver(frame)
+                if self.held: break
+        except Exception as e:
+            print(f"Receive error from {self.peer}: {e}")
+            self.transport.close()
+
+    def _deliver(self, frame):
+        # Only a broken stream ends the connection; a frame its handler fails on is dropped.
+        try: self.on_frame(frame)
+        except ProtocolError: raise
+        except Exception as e: print(f"Error handling frame from {self.peer}: {e}")
+
+    def _hello(self, frame):
+        # The time until the peer's HELLO arrives doubles as the session's initial RTT estimate.
+        if frame.type != FRAME_HELLO: raise ProtocolError("Expected HELLO from peer")
+        info = protocol.parse_hello(frame.payload); info["rtt"] = time.perf_counter() - self._started
+        self.info = info
+        self.engine.on_connection(self)
+        if not self.handshake.done(): self.handshake.set_result(info)
+
+    def hold(self):
+        # Stops delivering frames, and reading from the socket, until release().
+        self.held = True; self.transport.pause_reading()
+
+    def release(self):
+        self.held = False; self.transport.resume_reading(); self._dispatch()
+
+    def pause_writing(self): self._writable.clear()
+    def resume_writing(self): self._writable.set()
+
+    async def drain(self):
+        await self._writable.wait()
+        if self.closed: raise ConnectionError("Connection closed")
+
+    def write(self, data): self.transport.write(data)  # loop thread only
+
+    async def sendfile(self, file, offset, count):
+        # Loop thread only. The loop stops reading for the duration and resumes afterwards, so a
+        # hold() taken meanwhile is applied again once it returns.
+        if self.closed or self.transport.is_closing(): raise ConnectionError("Connection closed")
+        try: return await self.engine.loop.sendfile(self.transport, file, offset, count)
+        finally:
+            if self.held and not self.transport.is_closing(): self.transport.pause_reading()
+    def close(self): self.engine.loop.call_soon_threadsafe(self.transport.close)
+
+    def connection_lost(self, exc):
+        self.closed = True; self._writable.set()
+        self._handshake_failed(exc or ConnectionError("Connection closed during handshake"))
+        if self.on_close and self.info is not None: self.on_close(self)
+
+
+class NetworkEngine:
+    # `hello()` returns the encode_hello keyword arguments for new connections; `sink` is
+    # the FrameReader sink shared by all of them, called with the session connection first.
+    def __init__(self, on_connection, hello, sink=None):
+        self.on_connection, self.hello, self.sink = on_connection, hello, sink
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+        self.read_executor = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="file-read")
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def submit(self, coro): return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    def run_blocking(self, fn, *args): return self.executor.submit(fn, *args)
+    def stop(self): self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def listen(self, host, port):
+        # Resolves to the bound port.
+        return self.submit(self._listen(host, port))
+
+    async def _listen(self, host, port):
+        server = await self.loop.create_server(lambda: Connection(self, self.hello()), host, port, reuse_address=True)
+        return server.sockets[0].getsockname()[1]
+
+    def open(self, host, port, **extra):
+        # One attempt; resolves to the Connection once the peer's HELLO has arrived.
+        return self.submit(self._open(host, port, **extra))
+
+    async def _open(self, host, port, **extra):
+        _, conn = await asyncio.wait_for(self.loop.create_connection(lambda: Connection(self, dict(self.hello(), **extra), outbound=True), host, port), HANDSHAKE_TIMEOUT)
+        await conn.handshake
+        return conn
+
+    def connect(self, host, port, on_retry=None):
+        # Keeps trying until a connection completes its handshake; cancel() the returned
+        # future to give up. on_retry(error, delay) runs on the loop thread before each wait.
+        return self.submit(self._connect(host, port, on_retry))
+
+    async def _connect(self, host, port, on_retry):
+        delay = RECONNECT_MIN
+        while True:
+            try: return await self._open(host, port)
+            except (OSError, ProtocolError, asyncio.TimeoutError) as e:
+                if on_retry: on_retry(e, delay)
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            delay = min(delay * 2, RECONNECT_MAX)
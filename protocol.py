@@ -0,0 +1,207 @@
+import json
+import socket
+import struct
+import time
+import zlib
+
+# --- Wire Format ---
+# Every frame is a fixed 9-byte header followed by `length` payload bytes:
+#   version (B) | type (B) | flags (B) | channel (H) | length (I)
+# Channel 0 carries commands; file transfers get their own channel per direction.
+# DATA payloads start with the 8-byte file offset of the bytes that follow.
+PROTOCOL_VERSION = 1
+MIN_PROTOCOL_VERSION = 1
+HEADER = struct.Struct("!BBBHI")
+HELLO_MAGIC = b"VRTX"
+MAX_PAYLOAD = 64 * 1024 * 1024
+
+FRAME_HELLO, FRAME_CMD, FRAME_DATA, FRAME_WINDOW = 1, 2, 3, 4
+CONTROL_CHANNEL = 0
+FLAG_ZLIB = 0x01
+WINDOW = struct.Struct("!I")
+DATA_PREFIX = struct.Struct("!Q")
+
+# Optional capabilities advertised in HELLO; the session uses the intersection.
+LOCAL_FEATURES = ["flow-control", "stripe", "zlib", "zcmd2"]
+
+# Preset dictionary for command frames (feature "zcmd2"; bump the name if this changes). Each
+# frame is compressed on its own as raw deflate, so short commands carry no zlib header and an
+# encoded frame can be reused as-is for any peer.
+COMMAND_ZDICT = (b'"manifest": {"size": "chunk_size": 4194304, "chunks": ["digest": "ranges": [[0, "stripe": null'
+                 b'FILE_START_TRANSFER:FILE_REQUEST:FILE_ACCEPT:FILE_REJECT:FILE_RESUME:ADD_TO_GALLERY:REQUEST_DOWNLOAD:'
+                 b'DELETE_MSG:EDIT_MSG:CHAT_MSG:DRAW:STROKE_END:STROKE_BEGIN:#FFFFFF:3:0,0;1,0;0,1;1,1;-1,0;0,-1;-1,-1;STROKE:')
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(ftype, payload=b"", channel=CONTROL_CHANNEL, flags=0, version=PROTOCOL_VERSION):
+    if len(payload) > MAX_PAYLOAD: raise ProtocolError(f"Frame payload too large ({len(payload)} bytes)")
+    return HEADER.pack(version, ftype, flags, channel, len(payload)) + payload
+
+
+def encode_command(command_str, compress=False):
+    payload = command_str.encode('utf-8')
+    if compress:
+        packer = zlib.compressobj(6, zlib.DEFLATED, -15, zdict=COMMAND_ZDICT)
+        packed = packer.compress(payload) + packer.flush()
+        if len(packed) < len(payload): return encode_frame(FRAME_CMD, packed, flags=FLAG_ZLIB)
+    return encode_frame(FRAME_CMD, payload)
+
+
+def inflate(payload, zdict=None, limit=MAX_PAYLOAD):
+    unpacker = zlib.decompressobj(-15, zdict=zdict) if zdict else zlib.decompressobj()
+    try: data = unpacker.decompress(payload, limit)
+    except zlib.error as e: raise ProtocolError(f"Corrupt compressed payload: {e}")
+    if unpacker.unconsumed_tail: raise ProtocolError("Compressed payload expands past the frame limit")
+    return data
+
+
+def encode_data_header(channel, offset, size, flags=0):
+    return HEADER.pack(PROTOCOL_VERSION, FRAME_DATA, flags, channel, DATA_PREFIX.size + size) + DATA_PREFIX.pack(offset)
+
+
+def encode_window(channel, nbytes):
+    return encode_frame(FRAME_WINDOW, WINDOW.pack(nbytes), channel=channel)
+
+
+def encode_hello(name, features=None, **extra):
+    # `role` distinguishes the main session from auxiliary connections such as transfer stripes.
+    info = {"version": PROTOCOL_VERSION, "min_version": MIN_PROTOCOL_VERSION, "name": name, "role": "session",
+            "features": list(LOCAL_FEATURES if features is None else features), **extra}
+    return encode_frame(FRAME_HELLO, HELLO_MAGIC + json.dumps(info).encode('utf-8'))
+
+
+def parse_hello(payload):
+    payload = bytes(payload)
+    if not payload.startswith(HELLO_MAGIC): raise ProtocolError("Peer did not send a Vortex Tunnel handshake")
+    info = json.loads(payload[len(HELLO_MAGIC):].decode('utf-8'))
+    if info.get("version", 0) < MIN_PROTOCOL_VERSION or info.get("min_version", 0) > PROTOCOL_VERSION:
+        raise ProtocolError(f"Incompatible peer protocol version {info.get('version')}")
+    info["version"] = min(info["version"], PROTOCOL_VERSION)
+    info["features"] = sorted(set(info.get("features", [])) & set(LOCAL_FEATURES))
+    return info
+
+
+class Frame:
+    __slots__ = ("type", "flags", "channel", "payload", "offset", "direct")
+
+    def __init__(self, ftype, flags, channel, payload, offset=None, direct=False):
+        self.type, self.flags, self.channel, self.payload = ftype, flags, channel, payload
+        # `direct` DATA frames were received straight into the sink's memory; payload is that view.
+        self.offset, self.direct = offset, direct
+
+    def text(self):
+        payload = inflate(self.payload, COMMAND_ZDICT) if self.flags & FLAG_ZLIB else self.payload
+        return str(payload, 'utf-8', errors='ignore')
+
+
+# --- Receive Buffer ---
+class FrameReader:
+    # Frames are parsed in place from one reusable bytearray that the socket fills with
+    # recv_into, or an asyncio BufferedProtocol through get_buffer/buffer_updated. Payloads are
+    # memoryviews into that buffer and are only valid until more data is received, so
+    # consumers must copy or decode them straight away.
+    # An optional sink(channel, offset, size) may return a writable memoryview for a DATA
+    # frame (e.g. a slice of a memory-mapped output file); the payload is then received
+    # directly into it and never passes through the buffer beyond what was already read.
+    def __init__(self, capacity=256 * 1024, sink=None):
+        self._buf = bytearray(capacity); self._view = memoryview(self._buf)
+        self._start = self._end = 0
+        self.sink, self._direct, self._ready = sink, None, None
+
+    def __len__(self): return self._end - self._start
+
+    def _make_room(self, needed=1):
+        if len(self._buf) - self._end >= needed: return
+        pending = self._end - self._start
+        if self._start and pending + needed <= len(self._buf) // 2:
+            # Compact only when at least half the buffer is reclaimable, so each byte is moved
+            # a bounded number of times and total cost stays linear in bytes received.
+            self._buf[:pending] = self._buf[self._start:self._end]
+        else:
+            capacity = len(self._buf)
+            while capacity < pending + needed: capacity *= 2
+            new_buf = bytearray(capacity); new_buf[:pending] = self._buf[self._start:self._end]
+            self._buf, self._view = new_buf, memoryview(new_buf)
+        self._start, self._end = 0, pending
+
+    def get_buffer(self):
+        # Where the next received bytes should go: the rest of a direct frame's target, or the
+        # free tail of the buffer. Matches asyncio.BufferedProtocol.get_buffer.
+        if self._direct:
+            frame, target, filled = self._direct
+            return target[filled:]
+        self._make_room()
+        return self._view[self._end:]
+
+    def buffer_updated(self, n):
+        if self._direct:
+            frame, target, filled = self._direct
+            if filled + n == len(target): self._direct, self._ready = None, frame
+            else: self._direct = (frame, target, filled + n)
+        else: self._end += n
+
+    def recv_from(self, sock):
+        n = sock.recv_into(self.get_buffer())
+        self.buffer_updated(n)
+        return n
+
+    def frames(self):
+        if self._ready:
+            frame, self._ready = self._ready, None
+            yield frame
+        while not self._direct and self._end - self._start >= HEADER.size:
+            version, ftype, flags, channel, length = HEADER.unpack_from(self._buf, self._start)
+            if version < MIN_PROTOCOL_VERSION or version > PROTOCOL_VERSION: raise ProtocolError(f"Unsupported frame version {version}")
+            if length > MAX_PAYLOAD: raise ProtocolError(f"Frame payload too large ({length} bytes)")
+            if ftype == FRAME_DATA and length < DATA_PREFIX.size: raise ProtocolError("DATA frame without offset")
+            body = self._start + HEADER.size
+            if ftype == FRAME_DATA and self.sink and not flags & FLAG_ZLIB:
+                if self._end - body < DATA_PREFIX.size:
+                    self._make_room(HEADER.size + DATA_PREFIX.size)
+                    return
+                offset, size = DATA_PREFIX.unpack_from(self._buf, body)[0], length - DATA_PREFIX.size
+                target = self.sink(channel, offset, size)
+                if target is not None:
+                    start = body + DATA_PREFIX.size
+                    have = min(size, self._end - start)
+                    target[:have] = self._view[start:start + have]
+                    self._start = start + have
+                    frame = Frame(ftype, flags, channel, target, offset, direct=True)
+                    if have < size:
+                        self._direct = (frame, target, have)
+                        return
+                    yield frame
+                    continue
+            if self._end - body < length:
+                self._make_room(HEADER.size + length - (self._end - self._start))
+                return
+            self._start = body + length
+            if ftype == FRAME_DATA:
+                yield Frame(ftype, flags, channel, self._view[body + DATA_PREFIX.size:body + length], DATA_PREFIX.unpack_from(self._buf, body)[0])
+            else: yield Frame(ftype, flags, channel, self._view[body:body + length])
+
+    def read_frame(self, sock):
+        # Blocking helper used during the handshake, before the receive loop takes over.
+        while True:
+            for frame in self.frames(): return frame
+            if not self.recv_from(sock): raise ConnectionError("Connection closed during handshake")
+
+
+def handshake(sock, reader, name, timeout=10, **extra):
+    # Both sides send HELLO immediately and then wait for the peer's, so neither side has to
+    # know whether it accepted or initiated the connection.
+    # The time until the peer's HELLO arrives doubles as the session's initial RTT estimate.
+    sock.settimeout(timeout)
+    try:
+        started = time.perf_counter()
+        sock.sendall(encode_hello(name, **extra))
+        frame = reader.read_frame(sock)
+        if frame.type != FRAME_HELLO: raise ProtocolError("Expected HELLO from peer")
+        info = parse_hello(frame.payload)
+        info["rtt"] = time.perf_counter() - started
+        return info
+    except socket.timeout: raise ProtocolError("Peer did not complete the handshake")
+    finally: sock.settimeout(None)
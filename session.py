@@ -0,0 +1,514 @@
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+import protocol
+from protocol import FrameReader, FRAME_CMD, FRAME_DATA, FRAME_WINDOW, FLAG_ZLIB
+from mux import Multiplexer, INITIAL_WINDOW, MAX_CHUNK_SIZE
+from net import NetworkEngine
+from hub import Hub, RELAYED
+from metrics import Metrics, PING_INTERVAL_MS
+from history import MessageStore
+from content_index import ContentIndex, materialize
+from transfer import ChunkCompressor, ChunkSizer, FileSink, StripedSender, TransferState, stream_file, build_manifest, file_digest, STRIPE_MIN_SIZE
+from transfer import ArchiveReader, batch_entries, batch_summary, extract_archive, stream_archive
+
+# --- Session Engine ---
+# Everything the app does on the wire, without any UI: peer sessions, command routing, file
+# transfers with resume, deduplication and relaying, and the chat and gallery store. The app
+# (or a benchmark) supplies callbacks, which run on the network loop or a worker thread:
+#   on_command(command_str, peer)   a command for the UI: chat, drawing, gallery, file offers
+#   on_status(message, color)       progress and errors worth showing
+#   on_file(file_id, filename, path) a file finished arriving and passed its integrity check
+#   on_peer(peer, joined)           a peer session started or ended
+# Transfer bookkeeping, RTT probes and hub relaying are handled here, on the network loop.
+DEFAULT_PORT = 12345
+# Commands whose second field is a file id. Ids name files on disk (partial transfer state, a
+# hub's downloads), so a command carrying anything but a canonical UUID is dropped.
+FILE_ID_COMMANDS = frozenset(["FILE_REQUEST", "FILE_ACCEPT", "FILE_REJECT", "FILE_HAVE", "FILE_RESUME", "FILE_UNAVAILABLE",
+                              "REQUEST_DOWNLOAD", "FILE_START_TRANSFER", "ADD_TO_GALLERY", "DELETE_FILE"])
+# A hub takes in offered files without asking; larger ones, or ones that would leave less than
+# RELAY_MIN_FREE on disk, are refused.
+RELAY_MAX_SIZE = 2 * 1024 * 1024 * 1024
+RELAY_MIN_FREE = 1024 * 1024 * 1024
+SESSION_COMMANDS = ("FILE_ACCEPT", "FILE_REJECT", "FILE_HAVE", "FILE_RESUME", "FILE_UNAVAILABLE", "REQUEST_DOWNLOAD", "BATCH_ACCEPT", "BATCH_REJECT", "BATCH_ABORT",
+                    "BATCH_DONE", "BATCH_FAILED")
+
+
+def valid_file_id(file_id):
+    try: return str(uuid.UUID(file_id)) == file_id
+    except ValueError: return False
+
+
+def safe_filename(filename):
+    # A peer's filename only ever names a file inside a folder we chose.
+    name = os.path.basename(filename.replace("\\", "/"))
+    return name if name not in ("", ".", "..") else "file"
+
+
+def parse_file_request(command_str):
+    # FILE_REQUEST:<file_id>:<filename>:<size>:<digest>; the filename may itself contain colons.
+    _, file_id, rest = command_str.split(":", 2); filename, filesize, digest = rest.rsplit(":", 2)
+    return file_id, safe_filename(filename), int(filesize), digest
+
+
+class Session:
+    def __init__(self, folder, port=DEFAULT_PORT, on_command=None, on_status=None, on_file=None, on_peer=None):
+        self.on_command, self.on_status = on_command or (lambda command_str, peer: None), on_status or (lambda message, color: None)
+        self.on_file, self.on_peer = on_file or (lambda file_id, filename, path: None), on_peer or (lambda peer, joined: None)
+        self.name, self.host, self.port = None, "0.0.0.0", port
+        self.metrics = Metrics()
+        self.message_store = MessageStore(os.path.join(folder, "history.db"))
+        self.content_index = ContentIndex(os.path.join(folder, "content_index.db"))
+        self.downloads_folder = os.path.join(folder, "Vortex_Downloads")
+        os.makedirs(self.downloads_folder, exist_ok=True)
+        self.partials_folder = os.path.join(folder, "Partial_Transfers")
+        os.makedirs(self.partials_folder, exist_ok=True)
+        # Every connected peer, each with its own multiplexer; `connected` is set while any is.
+        self.hub, self.connected = Hub(on_overflow=self._peer_overflow), threading.Event()
+        # HELLO advertises our listening port, which the peer needs to open transfer stripes.
+        self.engine = NetworkEngine(self._on_connection, hello=lambda: {"name": self.name or "", "port": self.port}, sink=self._data_sink)
+        self.connect_task, self.reconnect_ip, self.reconnect_port = None, None, port
+        self.hub_mode, self.striped_transfers, self.relay_max_size = False, False, RELAY_MAX_SIZE
+        self.pending_transfers = {}
+        # Batches we offered (id -> entries), batches we accepted (id -> destination folder) and
+        # archives arriving, keyed like incoming_transfers by (connection, channel).
+        self.outgoing_batches, self.accepted_batches, self.incoming_batches = {}, {}, {}
+        self.incoming_transfers, self.incoming_files, self.stripe_tokens = {}, {}, {}
+        self.transfer_lock = threading.Lock()
+        self.metrics.watch_loop(self.engine.loop, "net_loop_lag")
+        self.engine.loop.call_soon_threadsafe(self._ping)
+
+    def listen(self):
+        # The listener stays up for the session's lifetime: it accepts peer sessions and any extra
+        # stripe connections a peer opens for large transfers. Returns the bound port.
+        self.port = self.engine.listen(self.host, self.port).result()
+        return self.port
+
+    def connect(self, peer_ip, port=None):
+        # Retries with backoff until the peer answers; a session we opened is re-established the
+        # same way if it drops.
+        self.reconnect_ip, self.reconnect_port = peer_ip, port or self.port
+        self._connect()
+
+    def _connect(self):
+        if self.connect_task: self.connect_task.cancel()
+        self.on_status(f"Connecting to {self.reconnect_ip}...", "orange")
+        self.connect_task = self.engine.connect(self.reconnect_ip, self.reconnect_port, on_retry=lambda e, delay: self.on_status(f"Connection failed: {e} (retrying in {delay:.0f}s)", "red"))
+
+    def close(self):
+        if self.connect_task: self.connect_task.cancel()
+        self.reconnect_ip = None
+        for peer in self.hub: peer.conn.close()
+
+    def send_command(self, data_str, peer=None):
+        # Broadcast to every peer unless one is given; a command is encoded once per wire format.
+        if peer: return self.hub.send(peer, data_str)
+        self.hub.broadcast(data_str)
+
+    def send_frame(self, frame_bytes, peer): return self.hub.send_frame(peer, frame_bytes)
+
+    def _peer_overflow(self, peer):
+        # A peer that stops reading is dropped rather than left to hold up memory for everyone.
+        print(f"Dropping {peer.name}: {peer.mux.backlog} bytes of commands queued"); peer.conn.close(); self.metrics.count("peers_dropped")
+
+    def _ping(self):
+        # RTT probe: PONG echoes our timestamp back, so no per-ping state is kept.
+        if self.connected.is_set(): self.send_command(f"PING:{time.perf_counter()}")
+        self.engine.loop.call_later(PING_INTERVAL_MS / 1000, self._ping)
+
+    # --- Connections ---
+    def _on_connection(self, conn):
+        # Every connection that completes the HELLO exchange, in either direction, on the network loop.
+        # Outside hub mode only one session is kept.
+        if conn.info.get("role") == "stripe": self._accept_stripe(conn, time.monotonic() + 5)
+        elif self.connected.is_set() and not self.hub_mode: conn.close()
+        else: self._start_session(conn)
+
+    def _start_session(self, conn):
+        if not conn.outbound and self.connect_task and not self.hub_mode: self.connect_task.cancel()
+        mux = Multiplexer(conn, on_error=lambda: self.handle_disconnect(conn), flow_control="flow-control" in conn.info["features"])
+        peer = self.hub.add(conn, mux); self.connected.set()
+        conn.on_frame, conn.on_close = (lambda frame: self._session_frame(peer, frame)), self.handle_disconnect
+        self.on_peer(peer, True)
+        self._resume_partial_transfers(peer)
+
+    def handle_disconnect(self, conn):
+        peer = self.hub.remove(conn)
+        if not peer: return
+        if not len(self.hub): self.connected.clear()
+        peer.mux.close(); conn.close()
+        # Partial files keep their sidecar state and are resumed when the peer reconnects.
+        with self.transfer_lock:
+            for file_id in [f for f, entry in self.incoming_files.items() if entry["peer"] is peer]:
+                entry = self.incoming_files.pop(file_id); entry["sink"].close(); entry["state"].save(force=True); self.metrics.transfer_finished(file_id)
+            for key in [k for k in self.incoming_transfers if k[0] is conn]: del self.incoming_transfers[key]
+            for token in [t for t, (_, p) in self.stripe_tokens.items() if p is peer]: del self.stripe_tokens[token]
+            for key in [k for k in self.incoming_batches if k[0] is conn]: self.incoming_batches.pop(key)["reader"].abort()
+        self.on_peer(peer, False)
+        if conn.outbound and self.reconnect_ip: self._connect()
+
+    def _open_stripe(self, peer_ip, port, token):
+        # Stripe senders are plain blocking sockets driven by the transfer's own workers.
+        sock = socket.create_connection((peer_ip, port), timeout=10)
+        try: protocol.handshake(sock, FrameReader(), self.name or "", role="stripe", token=token)
+        except Exception: sock.close(); raise
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _accept_stripe(self, conn, deadline):
+        # Stripes are only accepted from the connected peer, for a token announced in FILE_START_TRANSFER
+        # (which may still be in flight on the main connection when the stripe arrives); until then
+        # the stripe is held unread.
+        _, peer = self.stripe_tokens.get(conn.info.get("token"), (None, None))
+        if peer and conn.peer == peer.conn.peer:
+            conn.session = peer.conn
+            conn.on_frame = lambda frame: frame.type == FRAME_DATA and self._receive_file_chunk(peer, frame, stripe=True)
+            if conn.held: conn.release()
+        elif time.monotonic() < deadline and not conn.closed:
+            if not conn.held: conn.hold()
+            self.engine.loop.call_later(0.05, self._accept_stripe, conn, deadline)
+        else: conn.close()
+
+    # --- Commands ---
+    def _session_frame(self, peer, frame):
+        # Frames are length-prefixed, so parsing is linear in bytes received and payloads may
+        # contain any bytes, including newlines. Runs on the network loop; transfer commands are
+        # handled here, the rest go to on_command, and a hub forwards shared state to its other
+        # peers first.
+        if frame.type == FRAME_DATA:
+            if (peer.conn, frame.channel) in self.incoming_batches: self._receive_batch_chunk(peer, frame)
+            else: self._receive_file_chunk(peer, frame)
+        elif frame.type == FRAME_WINDOW: peer.mux.grant(frame.channel, protocol.WINDOW.unpack(frame.payload)[0])
+        elif frame.type == FRAME_CMD:
+            # A command that fails is logged and dropped; the connection carries on.
+            command_str = frame.text()
+            try: self._command(frame, command_str, peer)
+            except Exception as e: print(f"Error processing command: {e} -> '{command_str[:200]}'")
+
+    def _command(self, frame, command_str, peer):
+        cmd = command_str.split(":", 1)[0]
+        if cmd in FILE_ID_COMMANDS and not valid_file_id((command_str.split(":", 2) + [""])[1]): print(f"Dropping {cmd} with an invalid file id from {peer.name}")
+        elif cmd == "FILE_START_TRANSFER": self._begin_incoming_transfer(command_str, peer)
+        elif cmd == "BATCH_START": self._begin_incoming_batch(command_str, peer)
+        # The RTT probe is answered here on the network loop, so UI load does not skew it.
+        elif cmd == "PING": self.send_command("PONG:" + command_str[5:], peer)
+        elif cmd == "PONG": self.metrics.observe(f"rtt.{peer.name}", time.perf_counter() - float(command_str[5:]))
+        elif cmd in SESSION_COMMANDS or (cmd == "FILE_REQUEST" and self.hub_mode):
+            started = time.perf_counter()
+            self._session_command(cmd, command_str, peer)
+            self.metrics.observe(f"command.{cmd}", time.perf_counter() - started)
+        elif command_str:
+            if self.hub_mode and cmd in RELAYED: self.hub.forward(frame, peer)
+            self.on_command(command_str, peer)
+
+    def _session_command(self, cmd, command_str, peer):
+        if cmd == "FILE_REQUEST": self._relay_file(*parse_file_request(command_str), peer)
+        elif cmd == "FILE_ACCEPT": _, file_id = command_str.split(":", 1); self.engine.run_blocking(self._send_file_data, file_id, None, peer)
+        elif cmd == "FILE_HAVE": self.on_status(f"{peer.name} already had the file; nothing to send", "green")
+        elif cmd == "FILE_REJECT": _, file_id = command_str.split(":", 1); self.pending_transfers.pop(file_id, None); self.on_status("File transfer rejected by peer.", "orange")
+        elif cmd == "FILE_RESUME": _, file_id, ranges = command_str.split(":", 2); self.resume_file_data(file_id, json.loads(ranges), peer)
+        elif cmd == "FILE_UNAVAILABLE": _, file_id = command_str.split(":", 1); self._abandon_partial_transfer(file_id, peer)
+        elif cmd == "REQUEST_DOWNLOAD": _, file_id = command_str.split(":", 1); self.engine.run_blocking(self._send_file_data, file_id, None, peer)
+        elif cmd == "BATCH_ACCEPT": _, batch_id = command_str.split(":", 1); self.engine.run_blocking(self._send_batch_data, batch_id, peer)
+        elif cmd == "BATCH_REJECT": _, batch_id = command_str.split(":", 1); self.outgoing_batches.pop(batch_id, None); self.on_status("Batch transfer rejected by peer.", "orange")
+        elif cmd == "BATCH_DONE": _, batch_id = command_str.split(":", 1); self._batch_finished(batch_id, peer, True)
+        elif cmd == "BATCH_FAILED": _, batch_id = command_str.split(":", 1); self._batch_finished(batch_id, peer, False)
+        elif cmd == "BATCH_ABORT":
+            _, batch_id = command_str.split(":", 1)
+            for batch in [b for b in self.incoming_batches.values() if b["id"] == batch_id and b["peer"] is peer]: batch["reader"].abort()
+
+    # --- Sending Files ---
+    def send_file(self, filepath):
+        filename, filesize = os.path.basename(filepath), os.path.getsize(filepath)
+        file_id = str(uuid.uuid4())
+        self.on_status(f"Requesting to send {filename}...", "orange")
+        self.pending_transfers[file_id] = {"filepath": filepath}
+        self.engine.run_blocking(self._offer_file, file_id, filepath, filename, filesize)
+        return file_id
+
+    def _offer_file(self, file_id, filepath, filename, filesize):
+        # The offer carries the content hash so a peer that already holds the file can copy it
+        # locally. The digest comes from the content index, so an unchanged file is not re-read;
+        # the per-chunk manifest is only built once the peer accepts.
+        try: digest, filesize = self.content_index.digest(filepath), os.path.getsize(filepath)
+        except OSError as e: print(f"Error hashing file: {e}"); self.on_status(f"Could not read {filename}", "red"); return
+        self.send_command(f"FILE_REQUEST:{file_id}:{filename}:{filesize}:{digest}")
+
+    def _prepare_manifest(self, pending, filepath):
+        # Returns True if the file had to be (re)hashed, i.e. it is new or changed since its manifest.
+        stat = os.stat(filepath)
+        if pending.get("stamp") == (stat.st_mtime_ns, stat.st_size): return False
+        pending["manifest"], pending["stamp"] = build_manifest(filepath), (stat.st_mtime_ns, stat.st_size)
+        self.content_index.record(filepath, pending["manifest"]["digest"], stat)
+        return True
+
+    def _local_file(self, file_id):
+        # A file we offered, or one in our gallery that we offered or received; as a hub that is the
+        # single copy every peer downloads. Paths from peers' announcements are never served.
+        filepath = self.pending_transfers.get(file_id, {}).get("filepath") or self.message_store.local_path(file_id)
+        return filepath if filepath and os.path.exists(filepath) else None
+
+    def _send_file_data(self, file_id, ranges=None, peer=None):
+        filepath = self._local_file(file_id)
+        if not filepath or not peer or self.hub.get(peer.conn) is not peer: return
+        pending, channel = self.pending_transfers.setdefault(file_id, {"filepath": filepath}), None
+        try:
+            # A changed (or not yet hashed) file gets a fresh manifest and is sent in full.
+            if self._prepare_manifest(pending, filepath): ranges = None
+            if ranges is None: ranges = [[0, pending["manifest"]["size"]]]
+            channel, sizer = peer.mux.open_channel(), ChunkSizer(peer.mux, peer.info.get("rtt"))
+            compressor = ChunkCompressor(filepath, peer.mux) if "zlib" in peer.info["features"] else None
+            striped = self.striped_transfers and "stripe" in peer.info["features"] and sum(count for _, count in ranges) >= STRIPE_MIN_SIZE
+            token, peer_ip, peer_port = (uuid.uuid4().hex if striped else None), peer.conn.peer, peer.info.get("port", self.port)
+            # The filename travels inside the JSON, which may hold any character, colons included.
+            info = json.dumps({"filename": os.path.basename(filepath), "manifest": pending["manifest"], "ranges": ranges, "stripe": token})
+            self.send_command(f"FILE_START_TRANSFER:{file_id}:{pending['manifest']['size']}:{channel.id}:{info}", peer)
+            # Chunks queue on the transfer's own channel; chat and drawing commands are
+            # written ahead of them, so the UI stays responsive during large transfers.
+            total = sum(count for _, count in ranges)
+            if striped:
+                sender = StripedSender(filepath, ranges, channel, sizer, lambda: self._open_stripe(peer_ip, peer_port, token), compressor)
+                self.metrics.transfer_started(channel, os.path.basename(filepath), "out", total, lambda: sender.sent); sender.run()
+            else:
+                self.metrics.transfer_started(channel, os.path.basename(filepath), "out", total, lambda: channel.queued)
+                stream_file(channel, filepath, sizer, ranges, compressor)
+            self.on_status(f"Successfully sent {os.path.basename(filepath)}", "green")
+        # The pending entry is kept until the receiver confirms with ADD_TO_GALLERY, so a
+        # dropped connection can be resumed with FILE_RESUME.
+        except Exception as e: print(f"Error sending file data: {e}"); self.on_status("Failed to send file", "red")
+        finally:
+            if channel: self.metrics.transfer_finished(channel)
+
+    def resume_file_data(self, file_id, ranges, peer):
+        if self._local_file(file_id): self.engine.run_blocking(self._send_file_data, file_id, ranges, peer)
+        else: self.send_command(f"FILE_UNAVAILABLE:{file_id}", peer)
+
+    # --- Batches ---
+    # BATCH_REQUEST:<batch_id>:<summary json>   one offer for many files: count, total size, first names
+    # BATCH_ACCEPT / BATCH_REJECT:<batch_id>     the receiver's single decision
+    # BATCH_START:<batch_id>:<channel>           the archive follows as DATA on that channel
+    # BATCH_ABORT:<batch_id>                     the sender could not finish the archive
+    # BATCH_DONE / BATCH_FAILED:<batch_id>       the receiver's outcome, once the archive is extracted
+    def send_batch(self, paths):
+        batch_id = str(uuid.uuid4())
+        self.on_status(f"Requesting to send {len(paths)} item(s)...", "orange")
+        self.engine.run_blocking(self._offer_batch, batch_id, list(paths))
+        return batch_id
+
+    def _offer_batch(self, batch_id, paths):
+        try: entries = batch_entries(paths); summary = batch_summary(entries)
+        except OSError as e: print(f"Error listing batch: {e}"); self.on_status("Could not read the dropped items", "red"); return
+        self.outgoing_batches[batch_id] = (entries, summary)
+        self.send_command(f"BATCH_REQUEST:{batch_id}:{json.dumps(summary)}")
+
+    def _send_batch_data(self, batch_id, peer):
+        entries, summary = self.outgoing_batches.get(batch_id, (None, None))
+        if not entries or self.hub.get(peer.conn) is not peer: return
+        channel, total = None, summary["size"]
+        try:
+            channel = peer.mux.open_channel()
+            self.send_command(f"BATCH_START:{batch_id}:{channel.id}", peer)
+            self.metrics.transfer_started(channel, f"{summary['files']} files", "out", total, lambda: min(channel.queued, total))
+            stream_archive(channel, entries, ChunkSizer(peer.mux, peer.info.get("rtt")))
+            # Success is reported when the receiver confirms, with BATCH_DONE.
+            self.on_status(f"Sent {summary['files']} files, waiting for {peer.name}...", "orange")
+        except Exception as e:
+            print(f"Error sending batch: {e}"); self.on_status("Failed to send batch", "red")
+            self.send_command(f"BATCH_ABORT:{batch_id}", peer)
+        finally:
+            if channel: self.metrics.transfer_finished(channel)
+
+    def _batch_finished(self, batch_id, peer, ok):
+        entries, summary = self.outgoing_batches.pop(batch_id, (None, None))
+        if entries is None: return
+        if ok: self.on_status(f"Successfully sent {summary['files']} files", "green")
+        else: self.on_status(f"Batch transfer failed on {peer.name}'s side", "red")
+
+    def accept_batch(self, batch_id, summary, dest, peer):
+        self.accepted_batches[batch_id] = (dest, summary["size"]); self.send_command(f"BATCH_ACCEPT:{batch_id}", peer)
+
+    def reject_batch(self, batch_id, peer): self.send_command(f"BATCH_REJECT:{batch_id}", peer)
+
+    def _begin_incoming_batch(self, command_str, peer):
+        _, batch_id, channel = command_str.split(":", 2)
+        accepted, key = self.accepted_batches.pop(batch_id, None), (peer.conn, int(channel))
+        if accepted is None: self.on_status("Ignoring an unexpected batch", "orange"); return
+        (dest, total), batch = accepted, {"id": batch_id, "peer": peer, "unacked": 0}
+        batch["reader"] = ArchiveReader(lambda n: self._batch_consumed(batch, key[1], n))
+        self.incoming_batches[key] = batch
+        # Progress counts archive bytes against the files' total, so it stops just short of tar overhead.
+        self.metrics.transfer_started(key, "batch", "in", total, lambda: min(batch["reader"].consumed, total))
+        self.on_status("Receiving batch...", "orange")
+        threading.Thread(target=self._extract_batch, args=(key, batch, dest), daemon=True).start()
+
+    def _receive_batch_chunk(self, peer, frame):
+        # Frame payloads point into the frame reader's buffer, so queued chunks are copies.
+        batch = self.incoming_batches[(peer.conn, frame.channel)]
+        batch["reader"].feed(protocol.inflate(frame.payload, limit=MAX_CHUNK_SIZE) if frame.flags & FLAG_ZLIB else bytes(frame.payload))
+
+    def _batch_consumed(self, batch, channel, n):
+        batch["unacked"] += n
+        if batch["unacked"] >= INITIAL_WINDOW // 4: self.send_frame(protocol.encode_window(channel, batch["unacked"]), batch["peer"]); batch["unacked"] = 0
+
+    def _extract_batch(self, key, batch, dest):
+        # On failure the entry stays, with the reader aborted, so the rest of the stream is
+        # consumed and credited rather than stalling the sender; it goes with the connection.
+        try: extracted, skipped = extract_archive(batch["reader"], dest)
+        except Exception as e:
+            print(f"Error extracting batch: {e}"); batch["reader"].abort(); self.on_status("Batch transfer failed", "red")
+            self.send_command(f"BATCH_FAILED:{batch['id']}", batch["peer"]); return
+        finally: self.metrics.transfer_finished(key)
+        self.incoming_batches.pop(key, None)
+        self.send_command(f"BATCH_DONE:{batch['id']}", batch["peer"])
+        if skipped: print(f"Skipped existing or unsupported batch members: {skipped}")
+        self.on_status(f"Received {len(extracted)} files into {dest}" + (f", skipped {len(skipped)} existing or unsupported" if skipped else ""), "green")
+        # Indexed in the background, so offering any of them back is deduplicated.
+        self.content_index.scan(extracted)
+
+    # --- Receiving Files ---
+    def accept_file(self, file_id, filename, filesize, digest, save_path, peer):
+        # A file we already hold is copied locally instead; otherwise the peer is asked to send it.
+        source = self.content_index.lookup(digest, filesize)
+        if source: self.engine.run_blocking(self._copy_known_file, file_id, filename, digest, source, save_path, peer)
+        else: self.pending_transfers[file_id] = {"save_path": save_path}; self.send_command(f"FILE_ACCEPT:{file_id}", peer)
+
+    def reject_file(self, file_id, peer): self.send_command(f"FILE_REJECT:{file_id}", peer)
+
+    def request_download(self, file_id, save_path):
+        self.pending_transfers[file_id] = {"save_path": save_path}
+        self.send_command(f"REQUEST_DOWNLOAD:{file_id}")
+
+    def _relay_file(self, file_id, filename, filesize, digest, peer):
+        # A hub takes every offered file into its downloads folder and announces it with
+        # ADD_TO_GALLERY, so it is uploaded once and each peer downloads it from the hub.
+        if filesize > self.relay_max_size or shutil.disk_usage(self.downloads_folder).free - filesize < RELAY_MIN_FREE:
+            self.reject_file(file_id, peer); self.on_status(f"Refused {filename} from {peer.name}: too large to relay", "orange"); return
+        self.accept_file(file_id, filename, filesize, digest, os.path.join(self.downloads_folder, f"{file_id}_{filename}"), peer)
+
+    def _copy_known_file(self, file_id, filename, digest, source, save_path, peer):
+        # "Already have it": the sender is told there is nothing to send, and the local copy is
+        # finished like a received file. If the copy fails the file is downloaded after all.
+        try: materialize(source, save_path)
+        except OSError as e:
+            print(f"Error copying known file: {e}")
+            self.pending_transfers[file_id] = {"save_path": save_path}; self.send_command(f"FILE_ACCEPT:{file_id}", peer); return
+        self.send_command(f"FILE_HAVE:{file_id}", peer); self.metrics.count("dedup_hits")
+        self.content_index.record(save_path, digest)
+        self._file_received(file_id, filename, save_path)
+
+    def _begin_incoming_transfer(self, command_str, peer):
+        _, file_id, filesize, channel, info = command_str.split(":", 4)
+        info = json.loads(info); filename = safe_filename(info["filename"])
+        # Data for a transfer we never accepted, or one already arriving from another peer, is
+        # still consumed so the peer's window keeps moving.
+        with self.transfer_lock:
+            if file_id not in self.incoming_files: self._open_incoming_file(file_id, filename, info["manifest"], peer)
+            owned = file_id in self.incoming_files and self.incoming_files[file_id]["peer"] is peer
+            remaining = sum(count for _, count in info["ranges"])
+            if remaining: self.incoming_transfers[(peer.conn, int(channel))] = {"file_id": file_id if owned else None, "unacked": 0, "remaining": remaining}
+            if info.get("stripe") and owned: self.stripe_tokens[info["stripe"]] = (file_id, peer)
+
+    def _open_incoming_file(self, file_id, filename, manifest, peer):
+        state_path = os.path.join(self.partials_folder, f"{file_id}.json")
+        state = TransferState.load(state_path) if os.path.exists(state_path) else None
+        save_path = self.pending_transfers.pop(file_id, {}).get("save_path") or (state.save_path if state else None)
+        if not save_path: self.on_status(f"Ignoring unexpected transfer of {filename}", "orange"); return
+        if not state or state.manifest["digest"] != manifest["digest"]:
+            state = TransferState(state_path, file_id, filename, save_path, manifest, peer=peer.name)
+        self.on_status(f"Receiving {filename}...", "orange")
+        self.incoming_files[file_id] = {"state": state, "sink": FileSink(save_path, manifest["size"]), "peer": peer}
+        self.metrics.transfer_started(file_id, filename, "in", manifest["size"], lambda: state.received_bytes)
+        state.save(force=True)
+        if state.complete: self._finish_incoming_file(file_id)
+
+    def _data_sink(self, conn, channel, offset, size):
+        # Lets the frame reader receive file data straight into the memory-mapped output file.
+        transfer = self.incoming_transfers.get((conn, channel))
+        entry = transfer and self.incoming_files.get(transfer["file_id"])
+        return entry["sink"].target(offset, size) if entry else None
+
+    def _receive_file_chunk(self, peer, frame, stripe=False):
+        # Stripe connections deliver ranges out of order, interleaved on the network loop; each
+        # frame lands at its own offset in the mapped file, and only the bookkeeping is serialised.
+        transfer = self.incoming_transfers.get((peer.conn, frame.channel))
+        if not transfer: return
+        # Window credit counts wire bytes; progress counts the file bytes they carried.
+        entry = self.incoming_files.get(transfer["file_id"])
+        wire = size = len(frame.payload)
+        if frame.direct: frame.payload.release()
+        else:
+            data = protocol.inflate(frame.payload, limit=MAX_CHUNK_SIZE) if frame.flags & FLAG_ZLIB else frame.payload
+            if entry: entry["sink"].write(frame.offset, data)
+            size = len(data)
+        with self.transfer_lock:
+            if entry and transfer["file_id"] in self.incoming_files: self._record_file_chunk(transfer["file_id"], entry, frame.offset, size)
+            transfer["remaining"] -= size
+            if transfer["remaining"] <= 0 and not entry: self.incoming_transfers.pop((peer.conn, frame.channel), None)
+            elif not stripe:
+                # Stripes have their own TCP flow control; only main-connection data earns window credit.
+                transfer["unacked"] += wire
+                if transfer["unacked"] >= INITIAL_WINDOW // 4:
+                    self.send_frame(protocol.encode_window(frame.channel, transfer["unacked"]), peer); transfer["unacked"] = 0
+
+    def _record_file_chunk(self, file_id, entry, offset, size):
+        state = entry["state"]
+        failed = [index for index in state.record(offset, size) if not state.verify(index, entry["sink"])]
+        if failed: self.send_command(f"FILE_RESUME:{file_id}:{json.dumps([list(state.chunk_span(index)) for index in failed])}", entry["peer"])
+        if state.complete: self._finish_incoming_file(file_id)
+        else: state.save()
+
+    def _finish_incoming_file(self, file_id):
+        entry = self.incoming_files.pop(file_id); self.metrics.transfer_finished(file_id)
+        for token in [t for t, (f, _) in self.stripe_tokens.items() if f == file_id]: del self.stripe_tokens[token]
+        for key in [k for k, t in self.incoming_transfers.items() if t["file_id"] == file_id]: del self.incoming_transfers[key]
+        entry["sink"].close(); entry["state"].save(force=True)
+        self.engine.run_blocking(self._verify_incoming_file, entry["state"])
+
+    def _verify_incoming_file(self, state):
+        # Every chunk already matched its hash; the whole-file digest guards against a bad manifest.
+        ok = file_digest(state.save_path) == state.manifest["digest"]
+        state.remove()
+        if not ok: self.metrics.count("integrity_failures"); self.on_status(f"Integrity check failed for {state.filename}", "red"); return
+        self.content_index.record(state.save_path, state.manifest["digest"])
+        self._file_received(state.file_id, state.filename, state.save_path)
+
+    def _file_received(self, file_id, filename, save_path):
+        self.on_status(f"Successfully received {filename}", "green")
+        self.send_command(f"ADD_TO_GALLERY:{file_id}:{filename}")
+        self.message_store.add_file(file_id, filename, save_path, local=True)
+        self.on_file(file_id, filename, save_path)
+
+    def gallery_announced(self, file_id, filename):
+        # A peer finished receiving a file. Returns the path to list it under: our original if we
+        # offered it, otherwise where it will be saved once downloaded; None if it is already listed
+        # (or the id is not one of ours to name a file with).
+        if not valid_file_id(file_id): return None
+        offered = "filepath" in self.pending_transfers.get(file_id, {})
+        local_path = self.pending_transfers.pop(file_id)["filepath"] if offered else os.path.join(self.downloads_folder, f"{file_id}_{safe_filename(filename)}")
+        if self.message_store.file_path(file_id): return None
+        self.message_store.add_file(file_id, safe_filename(filename), local_path, local=offered)
+        return local_path
+
+    def _resume_partial_transfers(self, peer):
+        # Only the peer a partial file came from is asked for the rest of it.
+        for name in os.listdir(self.partials_folder):
+            if not name.endswith(".json"): continue
+            try: state = TransferState.load(os.path.join(self.partials_folder, name))
+            except (OSError, ValueError, KeyError): continue
+            if state.peer not in (None, peer.name): continue
+            if state.complete: self.engine.run_blocking(self._verify_incoming_file, state); continue
+            self.on_status(f"Resuming {state.filename}...", "orange")
+            self.send_command(f"FILE_RESUME:{state.file_id}:{json.dumps(state.missing_ranges())}", peer)
+
+    def _abandon_partial_transfer(self, file_id, peer):
+        state_path = os.path.join(self.partials_folder, f"{file_id}.json")
+        if not os.path.exists(state_path): return
+        state = TransferState.load(state_path)
+        if state.peer not in (None, peer.name): return
+        state.remove()
+        if os.path.exists(state.save_path): os.remove(state.save_path)
+        self.on_status(f"Could not resume {state.filename}; the sender no longer has it", "orange")
@@ -0,0 +1,30 @@
+import concurrent.futures
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from session import Session
+
+
+@pytest.fixture
+def session_pair(tmp_path):
+    # Two sessions over loopback, A listening and B connected to it, as two app instances would be.
+    joined = threading.Semaphore(0)
+    for folder in ("a", "b"): (tmp_path / folder).mkdir()
+    a = Session(str(tmp_path / "a"), port=0, on_peer=lambda peer, up: up and joined.release())
+    b = Session(str(tmp_path / "b"), on_peer=lambda peer, up: up and joined.release())
+    a.name, b.name = "A", "B"
+    b.connect("127.0.0.1", a.listen())
+    for _ in range(2): assert joined.acquire(timeout=10), "sessions did not connect"
+    yield a, b
+    # B goes first so it does not reconnect when A hangs up, and the loops are only stopped once
+    # every multiplexer's writer has returned, so no task is left pending.
+    muxes = [peer.mux for session in (a, b) for peer in session.hub]
+    for session in (b, a):
+        session.close()
+        if session.connect_task: concurrent.futures.wait([session.connect_task], timeout=5)
+    for mux in muxes: mux.close(); mux.writer.result(timeout=5)
+    for session in (a, b): session.engine.stop()
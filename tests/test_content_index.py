@@ -0,0 +1,34 @@
+import os
+
+import content_index
+from content_index import ContentIndex, materialize
+
+
+def test_digest_is_cached_until_the_file_changes(tmp_path, monkeypatch):
+    index, path = ContentIndex(str(tmp_path / "index.db")), tmp_path / "file.bin"
+    path.write_bytes(b"one")
+    hashed = []
+    monkeypatch.setattr(content_index, "file_digest", lambda p: hashed.append(p) or f"digest-{len(hashed)}")
+    assert index.digest(str(path)) == index.digest(str(path)) == "digest-1"
+    path.write_bytes(b"two!"); os.utime(path, ns=(1, 1))
+    assert index.digest(str(path)) == "digest-2" and len(hashed) == 2
+
+
+def test_lookup_drops_rows_for_changed_or_missing_files(tmp_path):
+    index = ContentIndex(str(tmp_path / "index.db"))
+    kept, changed, gone = (tmp_path / name for name in ("kept", "changed", "gone"))
+    for path in (kept, changed, gone): path.write_bytes(b"same"); index.record(str(path), "d")
+    changed.write_bytes(b"diff"); os.utime(changed, ns=(1, 1)); gone.unlink()
+    assert index.lookup("d", 4) == str(kept)
+    kept.unlink()
+    assert index.lookup("d", 4) is None
+    assert index.db.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 0
+
+
+def test_materialize_replaces_an_existing_destination(tmp_path):
+    source, dest = tmp_path / "source", tmp_path / "dest"
+    source.write_text("new"); dest.write_text("old")
+    materialize(str(source), str(dest))
+    assert dest.read_text() == "new"
+    materialize(str(source), str(dest))
+    assert dest.read_text() == "new"
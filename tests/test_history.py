@@ -0,0 +1,39 @@
+import json
+import uuid
+
+from history import MessageStore
+
+
+def test_only_current_message_state_is_kept(tmp_path):
+    store = MessageStore(str(tmp_path / "history.db"))
+    store.apply("CHAT_MSG:1:A:hello", "CHAT_MSG:2:B:hi: there", "EDIT_MSG:1:A:hello again", "CHAT_MSG:3:A:bye", "DELETE_MSG:3", "CHAT_MSG:1:A:duplicate")
+    assert [row[1:] for row in store.recent()] == [("1", "A", "hello again"), ("2", "B", "hi: there")]
+    store.apply("CLEAR_CHAT")
+    assert store.recent() == []
+
+
+def test_pages_walk_back_to_the_first_message(tmp_path):
+    store = MessageStore(str(tmp_path / "history.db"))
+    store.apply(*(f"CHAT_MSG:{i}:A:message {i}" for i in range(120)))
+    page, seen = store.recent(limit=50), []
+    while page: seen[:0] = [row[1] for row in page]; page = store.before(page[0][0], limit=50)
+    assert [row[1] for row in store.recent(limit=50)] == [str(i) for i in range(70, 120)]
+    assert seen == [str(i) for i in range(120)]
+
+
+def test_migrate_log_replays_chat_and_gallery_once(tmp_path):
+    log_path = tmp_path / "chat_history.log"
+    lines = ["CHAT_MSG:1:A:first", "CHAT_MSG:2:B:second\nline", "EDIT_MSG:1:A:edited", "DELETE_MSG:2", "ADD_TO_GALLERY:f1:photo.jpg", "DRAW:0,0,1,1,#000,3"]
+    log_path.write_text("\n".join(json.dumps(line) for line in lines) + "\n\n")
+    store = MessageStore(str(tmp_path / "history.db"))
+    store.migrate_log(str(log_path), lambda file_id, filename: f"/downloads/{file_id}_{filename}")
+    assert [row[1:] for row in store.recent()] == [("1", "A", "edited")]
+    assert store.files() == [("f1", "photo.jpg", "/downloads/f1_photo.jpg")] and store.local_path("f1") is None
+    assert not log_path.exists() and (tmp_path / "chat_history.log.migrated").exists()
+
+
+def test_only_local_gallery_rows_are_served(tmp_path):
+    store, offered, announced = MessageStore(str(tmp_path / "history.db")), str(uuid.uuid4()), str(uuid.uuid4())
+    store.add_file(offered, "mine.txt", "/home/me/mine.txt", local=True)
+    store.add_file(announced, "theirs.txt", "/etc/passwd")
+    assert store.local_path(offered) == "/home/me/mine.txt" and store.local_path(announced) is None
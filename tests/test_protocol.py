@@ -0,0 +1,52 @@
+import zlib
+
+import pytest
+
+import protocol
+from protocol import FrameReader, FRAME_CMD, FRAME_DATA, ProtocolError
+
+
+def _feed(reader, data, step):
+    # Delivers data the way a socket would, at most `step` bytes per receive.
+    frames = []
+    while data:
+        buffer = reader.get_buffer(); n = min(step, len(buffer), len(data))
+        buffer[:n] = data[:n]; reader.buffer_updated(n); data = data[n:]
+        frames += [(frame.type, frame.channel, frame.offset, bytes(frame.payload), frame.direct) for frame in reader.frames()]
+    return frames
+
+
+@pytest.mark.parametrize("step", [1, 7, 4096])
+def test_frames_split_across_receives(step):
+    data = protocol.encode_command("CHAT_MSG:1:A:hello") + protocol.encode_data_header(3, 100, 5) + b"abcde" + protocol.encode_command("PING:1")
+    frames = _feed(FrameReader(capacity=16), data, step)
+    assert [(ftype, channel, offset, payload) for ftype, channel, offset, payload, _ in frames] == [
+        (FRAME_CMD, 0, None, b"CHAT_MSG:1:A:hello"), (FRAME_DATA, 3, 100, b"abcde"), (FRAME_CMD, 0, None, b"PING:1")]
+
+
+def test_oversized_frame_is_rejected():
+    header = protocol.HEADER.pack(protocol.PROTOCOL_VERSION, FRAME_CMD, 0, 0, protocol.MAX_PAYLOAD + 1)
+    with pytest.raises(ProtocolError): _feed(FrameReader(), header, 4096)
+
+
+@pytest.mark.parametrize("step", [1, 9, 4096])
+def test_direct_data_frames_land_in_sink(step):
+    target, calls = bytearray(16), []
+
+    def sink(channel, offset, size):
+        calls.append((channel, offset, size)); return memoryview(target)[offset:offset + size]
+
+    data = protocol.encode_data_header(2, 4, 6) + b"ABCDEF" + protocol.encode_command("PING:1")
+    frames = _feed(FrameReader(capacity=16, sink=sink), data, step)
+    assert calls == [(2, 4, 6)] and target[4:10] == b"ABCDEF"
+    assert [(ftype, direct) for ftype, _, _, _, direct in frames] == [(FRAME_DATA, True), (FRAME_CMD, False)]
+
+
+def test_compressed_commands_round_trip():
+    command, reader = "CHAT_MSG:1:A:" + "hello " * 50, FrameReader()
+    data = protocol.encode_command(command, compress=True)
+    reader.get_buffer()[:len(data)] = data; reader.buffer_updated(len(data))
+    [frame] = reader.frames()
+    assert frame.flags & protocol.FLAG_ZLIB and frame.text() == command
+    with pytest.raises(ProtocolError): protocol.inflate(b"not deflate data")
+    with pytest.raises(ProtocolError): protocol.inflate(zlib.compress(b"x" * 100), limit=10)
@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import mux
+import net
+from session import parse_file_request, safe_filename, valid_file_id
+
+
+def test_file_ids_must_be_canonical_uuids():
+    file_id = str(uuid.uuid4())
+    assert valid_file_id(file_id)
+    assert not valid_file_id(file_id.upper()) and not valid_file_id("../../secret") and not valid_file_id("")
+
+
+def test_peer_filenames_are_reduced_to_a_basename():
+    assert safe_filename("notes.txt") == "notes.txt"
+    assert safe_filename("../../etc/passwd") == "passwd" and safe_filename("..\\..\\boot.ini") == "boot.ini"
+    assert safe_filename("/abs/path.txt") == "path.txt" and safe_filename("..") == "file" and safe_filename("dir/") == "file"
+    file_id = str(uuid.uuid4())
+    assert parse_file_request(f"FILE_REQUEST:{file_id}:../12:30 notes.txt:42:abcd") == (file_id, "12:30 notes.txt", 42, "abcd")
+
+
+def _accept_offers(session, dest=None):
+    def on_command(command_str, peer):
+        if command_str.startswith("FILE_REQUEST:"):
+            file_id, filename, filesize, digest = parse_file_request(command_str)
+            session.accept_file(file_id, filename, filesize, digest, os.path.join(session.downloads_folder, filename), peer)
+        elif command_str.startswith("BATCH_REQUEST:"):
+            _, batch_id, summary = command_str.split(":", 2); session.accept_batch(batch_id, json.loads(summary), dest, peer)
+    session.on_command = on_command
+
+
+def test_filename_with_colons_arrives(session_pair, tmp_path):
+    a, b = session_pair
+    src = tmp_path / "12:30 notes.txt"; src.write_text("hello:world")
+    received = threading.Event()
+    _accept_offers(b); b.on_file = lambda file_id, filename, path: received.set()
+    a.send_file(str(src))
+    assert received.wait(10)
+    assert (tmp_path / "b" / "Vortex_Downloads" / "12:30 notes.txt").read_text() == "hello:world"
+
+
+def test_batch_with_symlinks_sends_the_real_files(session_pair, tmp_path):
+    a, b = session_pair
+    top, dest = tmp_path / "proj", tmp_path / "dest"
+    (top / "sub").mkdir(parents=True); dest.mkdir()
+    (top / "a.txt").write_text("a"); (top / "sub" / "b.txt").write_text("b")
+    os.symlink("a.txt", top / "link.txt")
+    done, statuses = threading.Event(), []
+    _accept_offers(b, str(dest))
+    a.on_status = lambda message, color: statuses.append(message) or (message.startswith(("Successfully", "Batch transfer failed")) and done.set())
+    a.send_batch([str(top)])
+    assert done.wait(10) and statuses[-1] == "Successfully sent 2 files"
+    assert sorted(os.path.relpath(os.path.join(root, name), dest) for root, _, files in os.walk(dest) for name in files) == ["proj/a.txt", "proj/sub/b.txt"]
+
+
+def test_malformed_commands_keep_the_session(session_pair):
+    a, b = session_pair
+    received = []
+    a.on_command = lambda command_str, peer: received.append(command_str)
+    b.send_command(f"FILE_START_TRANSFER:{uuid.uuid4()}:5:3:not json")
+    b.send_command("BATCH_START:batch:not-a-channel")
+    b.send_command("CHAT_MSG:1:B:still here")
+    deadline = time.monotonic() + 5
+    while not received and time.monotonic() < deadline: time.sleep(0.01)
+    assert received == ["CHAT_MSG:1:B:still here"]
+
+
+def test_more_concurrent_sends_than_blocking_workers(session_pair, tmp_path):
+    # Each send holds a blocking worker while its channel queue is full; the file reads that
+    # drain those queues must not wait behind them.
+    a, b = session_pair
+    count, received, chats = net.BLOCKING_WORKERS + 2, threading.Semaphore(0), []
+    _accept_offers(b); b.on_file = lambda file_id, filename, path: received.release()
+    for i in range(count): (tmp_path / f"f{i}.zip").write_bytes(os.urandom(4 * 1024 * 1024))
+    for i in range(count): a.send_file(str(tmp_path / f"f{i}.zip"))
+    chat = b.on_command
+    b.on_command = lambda command_str, peer: chats.append(command_str) if command_str.startswith("CHAT_MSG:") else chat(command_str, peer)
+    time.sleep(0.2); a.send_command("CHAT_MSG:1:A:during transfers")
+    for _ in range(count): assert received.acquire(timeout=20), "transfers stalled"
+    assert chats == ["CHAT_MSG:1:A:during transfers"]
+
+
+def test_announced_files_are_not_served(session_pair):
+    # A file a peer announced is listed under our downloads folder, and even once something
+    # exists there it is not ours to send.
+    a, b = session_pair
+    file_id = str(uuid.uuid4())
+    path = a.gallery_announced(file_id, "../../secret.txt")
+    assert os.path.dirname(path) == a.downloads_folder
+    with open(path, "w") as f: f.write("key")
+    echoed, statuses = threading.Event(), []
+    b.on_command, b.on_status = lambda command_str, peer: echoed.set(), lambda message, color: statuses.append(message)
+    a.on_command = lambda command_str, peer: a.send_command("CHAT_MSG:2:A:echo", peer)
+    b.send_command(f"REQUEST_DOWNLOAD:{file_id}"); b.send_command("CHAT_MSG:1:B:done")
+    assert echoed.wait(5)
+    time.sleep(0.2)
+    assert not any("transfer" in message for message in statuses)
+
+
+def test_a_file_the_receiver_holds_is_copied_locally(session_pair, tmp_path):
+    a, b = session_pair
+    src = tmp_path / "photo.jpg"; src.write_bytes(os.urandom(300_000))
+    held = tmp_path / "b" / "held.jpg"; held.write_bytes(src.read_bytes())
+    b.content_index.digest(str(held))
+    received, statuses = threading.Event(), []
+    _accept_offers(b); b.on_file = lambda file_id, filename, path: received.set()
+    a.on_status = lambda message, color: statuses.append(message)
+    a.send_file(str(src))
+    assert received.wait(10)
+    assert (tmp_path / "b" / "Vortex_Downloads" / "photo.jpg").read_bytes() == src.read_bytes()
+    deadline = time.monotonic() + 5
+    while "B already had the file; nothing to send" not in statuses and time.monotonic() < deadline: time.sleep(0.01)
+    assert "B already had the file; nothing to send" in statuses
+    assert b.metrics.snapshot()["counters"].get("dedup_hits") == 1
+
+
+def test_a_lone_transfer_is_sent_zero_copy(session_pair, tmp_path, monkeypatch):
+    a, b = session_pair
+    src = tmp_path / "video.mp4"; src.write_bytes(os.urandom(8 * 1024 * 1024))
+    zero_copy, sendfile = [], net.Connection.sendfile
+    monkeypatch.setattr(net.Connection, "sendfile", lambda self, *args: zero_copy.append(args[2]) or sendfile(self, *args))
+    received = threading.Event()
+    _accept_offers(b); b.on_file = lambda file_id, filename, path: received.set()
+    a.send_file(str(src))
+    assert received.wait(10)
+    assert (tmp_path / "b" / "Vortex_Downloads" / "video.mp4").read_bytes() == src.read_bytes()
+    assert zero_copy and sum(zero_copy) <= src.stat().st_size and max(zero_copy) <= mux.MAX_CHUNK_SIZE
@@ -0,0 +1,87 @@
+import json
+import os
+
+import pytest
+
+from strokes import StrokeBuilder, StrokeStore, coalesce, decode_deltas, encode_deltas, simplify
+
+
+def test_simplify_drops_collinear_points_and_keeps_corners():
+    assert simplify([(0, 0), (1, 0), (2, 0), (3, 0)]) == [(0, 0), (3, 0)]
+    assert simplify([(0, 0), (5, 0), (5, 5)]) == [(0, 0), (5, 0), (5, 5)]
+    assert simplify([(0, 0), (5, 0.5), (10, 0)]) == [(0, 0), (10, 0)]
+    assert simplify([(1, 1)]) == [(1, 1)]
+
+
+def test_simplify_handles_long_strokes():
+    points = [(i, (i * 7) % 13) for i in range(3000)]
+    kept = simplify(points)
+    assert kept[0] == points[0] and kept[-1] == points[-1]
+
+
+def test_deltas_round_trip():
+    points = [(10, 10), (12, 9), (12, 30)]
+    assert decode_deltas(encode_deltas(points)) == points
+    assert decode_deltas(encode_deltas(points, (5, 5)), (5, 5)) == points
+    assert decode_deltas("") == []
+
+
+def test_coalesce_merges_batches_of_one_stroke():
+    commands = ["STROKE_BEGIN:s1:#fff:3:1,1", "STROKE:s1:2,2", "STROKE:s1:3,3", "STROKE:s2:1,1", "STROKE_END:s1", "STROKE:s1:4,4"]
+    assert coalesce(commands) == ["STROKE_BEGIN:s1:#fff:3:1,1;2,2;3,3", "STROKE:s2:1,1", "STROKE_END:s1", "STROKE:s1:4,4"]
+    assert coalesce(["STROKE_BEGIN:s1:#fff:3:", "STROKE:s1:2,2"]) == ["STROKE_BEGIN:s1:#fff:3:2,2"]
+
+
+def test_coalesce_chains_legacy_draw_segments():
+    commands = ["DRAW:0,0,1,1,#000,3", "DRAW:1,1,2,2,#000,3", "DRAW:5,5,6,6,#000,3", "DRAW:6,6,7,7,#fff,3"]
+    assert coalesce(commands) == ["DRAW:0,0,1,1,2,2,#000,3", "DRAW:5,5,6,6,#000,3", "DRAW:6,6,7,7,#fff,3"]
+
+
+def test_builder_sends_each_point_once_anchored_on_the_last_batch():
+    stroke = StrokeBuilder("#fff", 3, 0, 0)
+    for x in range(1, 5): stroke.add(x, 0)
+    first = stroke.flush()
+    assert first == f"STROKE_BEGIN:{stroke.id}:#fff:3:0,0;4,0"
+    stroke.add(4, 3); stroke.add(4, 6)
+    assert stroke.flush() == f"STROKE:{stroke.id}:0,6" and stroke.flush() is None
+    assert stroke.sent == [(0, 0), (4, 0), (4, 6)]
+
+
+def _stroke(stroke_id, points, color="#ff0000"): return {"id": stroke_id, "color": color, "size": 4, "points": points}
+
+
+def test_snapshot_grows_to_cover_strokes_beyond_its_size(tmp_path):
+    store = StrokeStore(str(tmp_path / "canvas"))
+    store.add(_stroke("s1", [[10, 10], [2500, 1500]])); store.compact()
+    assert store.snapshot.size == (2504, 1504) and store.snapshot.getpixel((2500, 1500)) == (255, 0, 0)
+    store.add(_stroke("s2", [[5, 5], [6, 6]])); store.compact()
+    assert store.snapshot.size == (2504, 1504) and store.snapshot.getpixel((2500, 1500)) == (255, 0, 0)
+
+
+def test_merge_copies_strokes_from_a_larger_peer_snapshot(tmp_path):
+    ours, theirs = StrokeStore(str(tmp_path / "ours")), StrokeStore(str(tmp_path / "theirs"))
+    ours.add(_stroke("s1", [[10, 10], [20, 10]], "#00ff00")); ours.compact()
+    theirs.add(_stroke("s2", [[3000, 2000], [3010, 2000]])); theirs.compact()
+    assert ours.merge(json.loads(theirs.sync_payload())) == ("merge", [])
+    assert ours.snapshot.size == (3014, 2004)
+    assert ours.snapshot.getpixel((3005, 2000)) == (255, 0, 0) and ours.snapshot.getpixel((15, 10)) == (0, 255, 0)
+
+
+def test_merge_without_changes_does_not_decode_or_save(tmp_path, monkeypatch):
+    ours = StrokeStore(str(tmp_path / "ours"))
+    ours.add(_stroke("s1", [[10, 10], [20, 10]])); ours.compact(); ours.add(_stroke("s2", [[1, 1]]))
+    payload = json.loads(ours.sync_payload())
+    monkeypatch.setattr(StrokeStore, "_decode", lambda snapshot: pytest.fail("decoded an unchanged snapshot"))
+    monkeypatch.setattr(StrokeStore, "_save", lambda self: pytest.fail("saved an unchanged state"))
+    assert ours.merge(payload) == ("merge", [])
+    assert ours.merge(dict(payload, epoch=ours.epoch - 1)) == (None, None)
+
+
+def test_state_survives_a_restart(tmp_path):
+    store = StrokeStore(str(tmp_path / "canvas"))
+    store.add(_stroke("s1", [[10, 10], [20, 10]])); store.compact(); store.add(_stroke("s2", [[1, 1]]))
+    reopened = StrokeStore(str(tmp_path / "canvas"))
+    assert reopened.known("s1") and reopened.known("s2") and reopened.snapshot_digest == store.snapshot_digest
+    assert reopened.snapshot.size == store.snapshot.size
+    reopened.clear(5.0)
+    assert not os.path.exists(tmp_path / "canvas" / "snapshot.png") and not reopened.known("s2")
@@ -0,0 +1,39 @@
+import os
+
+from PIL import Image
+
+from thumbnails import ThumbnailCache, content_key, make_thumbnail
+
+
+def _thumb(color): return Image.new("RGB", (64, 64), color)
+
+
+def test_cache_evicts_least_recently_used_first(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "thumbs"))
+    cache.put("a", _thumb("red")); cache.put("b", _thumb("green"))
+    cache.max_bytes = cache.total + 1
+    assert cache.get("a")[0]
+    cache.put("c", _thumb("blue"))
+    assert sorted(os.listdir(tmp_path / "thumbs")) == ["a.png", "c.png"]
+    assert not cache.get("b")[0] and cache.get("c")[1].size == (64, 64)
+
+
+def test_non_images_are_cached_as_markers(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "thumbs"))
+    cache.put("doc", None)
+    assert cache.get("doc") == (True, None) and cache.get("missing") == (False, None)
+
+
+def test_cache_order_survives_a_restart(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "thumbs"))
+    cache.put("old", _thumb("red")); cache.put("new", _thumb("green"))
+    os.utime(tmp_path / "thumbs" / "old.png", (1, 1))
+    reopened = ThumbnailCache(str(tmp_path / "thumbs"))
+    assert list(reopened.entries) == ["old.png", "new.png"] and reopened.total == cache.total
+
+
+def test_thumbnails_are_keyed_by_content(tmp_path):
+    first, second = tmp_path / "a.png", tmp_path / "b.png"
+    _thumb("red").save(first); _thumb("red").save(second)
+    assert content_key(str(first), first.stat().st_size) == content_key(str(second), second.stat().st_size)
+    assert make_thumbnail(str(first)).size == (64, 64) and make_thumbnail(str(tmp_path)) is None
@@ -0,0 +1,104 @@
+import io
+import os
+import tarfile
+import types
+
+from transfer import ChunkCompressor, FileSink, TransferState, batch_entries, batch_summary, build_manifest, extract_archive
+
+
+def test_file_sink_writes_in_place(tmp_path):
+    sink = FileSink(str(tmp_path / "out.bin"), 8)
+    sink.write(4, b"5678"); sink.write(0, b"1234"); sink.close()
+    assert (tmp_path / "out.bin").read_bytes() == b"12345678"
+
+
+def _state(tmp_path, size=10, chunk_size=4):
+    manifest = {"size": size, "chunk_size": chunk_size, "chunks": ["x"] * -(-size // chunk_size), "digest": "x"}
+    return TransferState(str(tmp_path / "state.json"), "id", "f.bin", str(tmp_path / "f.bin"), manifest)
+
+
+def test_record_reports_chunks_as_they_fill(tmp_path):
+    state = _state(tmp_path)
+    assert state.record(0, 3) == []
+    assert state.record(3, 6) == [0, 1]
+    assert state.record(9, 1) == [2]
+    assert state.received_bytes == 10
+
+
+def test_missing_ranges_merge_adjacent_chunks(tmp_path):
+    state = _state(tmp_path)
+    assert state.missing_ranges() == [[0, 10]]
+    state.done[1] = ord("1")
+    assert state.missing_ranges() == [[0, 4], [8, 2]]
+    state.done[0] = state.done[2] = ord("1")
+    assert state.missing_ranges() == [] and state.complete
+
+
+def test_verify_accepts_matching_chunks_and_resets_corrupt_ones(tmp_path):
+    src = tmp_path / "src.bin"; src.write_bytes(b"abcdefghij")
+    manifest = build_manifest(str(src), chunk_size=4)
+    state = TransferState(str(tmp_path / "state.json"), "id", "f.bin", str(tmp_path / "f.bin"), manifest)
+    sink = FileSink(str(tmp_path / "f.bin"), 10)
+    sink.write(0, b"abcdXXXXij")
+    for index in state.record(0, 10): state.verify(index, sink)
+    assert state.missing_ranges() == [[4, 4]] and state.received[1] == 0
+    sink.close()
+
+
+def test_compressor_skips_media_and_gives_up_on_random_data(tmp_path):
+    mux = types.SimpleNamespace(throughput=0.0)
+    assert not ChunkCompressor(str(tmp_path / "clip.mp4"), mux).active
+    compressor = ChunkCompressor(str(tmp_path / "data.bin"), mux)
+    for _ in range(ChunkCompressor.PROBE_CHUNKS): assert compressor.active and compressor.compress(os.urandom(64 * 1024)) is None
+    assert not compressor.active
+
+
+def test_compressor_stands_aside_while_the_link_is_faster(tmp_path):
+    mux = types.SimpleNamespace(throughput=0.0)
+    compressor = ChunkCompressor(str(tmp_path / "log.txt"), mux)
+    for _ in range(ChunkCompressor.PROBE_CHUNKS): assert compressor.compress(b"the same line again\n" * 4096) is not None
+    assert compressor.active
+    mux.throughput = compressor.rate * 2
+    assert not compressor.active
+    mux.throughput = compressor.rate / 2
+    assert compressor.active
+
+
+def _archive(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w", format=tarfile.PAX_FORMAT) as tar:
+        for name, kind, data in members:
+            info = tarfile.TarInfo(name); info.type, info.size = kind, len(data)
+            if kind == tarfile.SYMTYPE: info.linkname = "/etc/passwd"
+            tar.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+def test_extract_skips_links_and_paths_outside_dest(tmp_path):
+    dest = tmp_path / "dest"; dest.mkdir()
+    archive = _archive([("top", tarfile.DIRTYPE, b""), ("top/link", tarfile.SYMTYPE, b""), ("../escape.txt", tarfile.REGTYPE, b"no"),
+                        ("/abs.txt", tarfile.REGTYPE, b"no"), ("top/fifo", tarfile.FIFOTYPE, b""), ("top/ok.txt", tarfile.REGTYPE, b"yes")])
+    extracted, skipped = extract_archive(archive, str(dest))
+    assert extracted == [os.path.realpath(dest / "top" / "ok.txt")] and (dest / "top" / "ok.txt").read_bytes() == b"yes"
+    assert skipped == ["top/link", "../escape.txt", "/abs.txt", "top/fifo"]
+    assert sorted(os.listdir(dest / "top")) == ["ok.txt"] and not (tmp_path / "escape.txt").exists()
+
+
+def test_batch_entries_leave_out_symlinks(tmp_path):
+    top = tmp_path / "proj"; (top / "sub").mkdir(parents=True)
+    (top / "a.txt").write_text("a"); (top / "sub" / "b.txt").write_text("bb")
+    os.symlink("a.txt", top / "link.txt"); os.symlink("sub", top / "sublink")
+    entries = batch_entries([str(top)])
+    assert [arcname for _, arcname in entries] == ["proj", "proj/sub", "proj/a.txt", "proj/sub/b.txt"]
+    assert batch_summary(entries) == {"files": 2, "size": 3, "names": ["proj/a.txt", "proj/sub/b.txt"]}
+
+
+def test_extract_never_overwrites_existing_files(tmp_path):
+    dest = tmp_path / "dest"; (dest / "top").mkdir(parents=True)
+    (dest / "top" / "mine.txt").write_text("mine"); (dest / "top" / "file").write_text("a file")
+    archive = _archive([("top", tarfile.DIRTYPE, b""), ("top/mine.txt", tarfile.REGTYPE, b"theirs"), ("top/file", tarfile.DIRTYPE, b""),
+                        ("top/new.txt", tarfile.REGTYPE, b"new")])
+    extracted, skipped = extract_archive(archive, str(dest))
+    assert extracted == [os.path.realpath(dest / "top" / "new.txt")] and skipped == ["top/mine.txt", "top/file"]
+    assert (dest / "top" / "mine.txt").read_text() == "mine" and (dest / "top" / "file").read_text() == "a file"
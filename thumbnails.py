@@ -0,0 +1,101 @@
+import collections
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Thumbnail Pipeline ---
+# Gallery thumbnails are made on a small worker pool and cached on disk, keyed by file content
+# rather than path, so a file renamed or received twice reuses its thumbnail. JPEGs are decoded
+# with draft() at a reduced scale, which skips most of the decode work for large photos. PIL is
+# imported by the first worker that needs it, not at app startup.
+THUMB_SIZE = 64
+CACHE_BYTES = 32 * 1024 * 1024
+KEY_SAMPLE = 64 * 1024
+WORKERS = min(4, os.cpu_count() or 1)
+
+
+def content_key(path, size):
+    # The size plus the first and last 64 KB identifies a file well enough for a thumbnail and
+    # costs the same for a 10 KB icon as for a 4 GB video.
+    digest = hashlib.sha256(str(size).encode('ascii'))
+    with open(path, 'rb') as f:
+        digest.update(f.read(KEY_SAMPLE))
+        if size > 2 * KEY_SAMPLE: f.seek(size - KEY_SAMPLE); digest.update(f.read(KEY_SAMPLE))
+    return digest.hexdigest()[:32]
+
+
+def make_thumbnail(path):
+    # Returns None for anything PIL cannot open; those files show a placeholder.
+    from PIL import Image
+    try:
+        with Image.open(path) as img:
+            img.draft("RGB", (THUMB_SIZE * 2, THUMB_SIZE * 2))
+            img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+            return img.convert("RGBA") if img.mode not in ("RGB", "RGBA", "L", "LA") else img.copy()
+    except Exception: return None
+
+
+class ThumbnailCache:
+    # <key>.png holds a thumbnail, an empty <key>.none records that the file is not an image.
+    # File mtimes give the LRU order across runs; the oldest entries go once CACHE_BYTES is exceeded.
+    def __init__(self, folder, max_bytes=CACHE_BYTES):
+        os.makedirs(folder, exist_ok=True)
+        self.folder, self.max_bytes, self.lock = folder, max_bytes, threading.Lock()
+        entries = []
+        for name in os.listdir(folder):
+            try: st = os.stat(os.path.join(folder, name))
+            except OSError: continue
+            entries.append((st.st_mtime, name, st.st_size))
+        self.entries = collections.OrderedDict((name, size) for _, name, size in sorted(entries))
+        self.total = sum(self.entries.values())
+
+    def get(self, key):
+        # Returns (hit, image).
+        with self.lock:
+            for name in (key + ".png", key + ".none"):
+                if name in self.entries: self.entries.move_to_end(name); break
+            else: return False, None
+        path = os.path.join(self.folder, name)
+        try:
+            os.utime(path)
+            if name.endswith(".none"): return True, None
+            from PIL import Image
+            with Image.open(path) as img: img.load(); return True, img
+        except OSError:
+            with self.lock: self.total -= self.entries.pop(name, 0)
+            return False, None
+
+    def put(self, key, image):
+        name = key + (".png" if image is not None else ".none")
+        path = os.path.join(self.folder, name)
+        try:
+            if image is not None: image.save(path, "PNG")
+            else: open(path, 'wb').close()
+            size = os.path.getsize(path)
+        except OSError: return
+        with self.lock:
+            self.total += size - self.entries.pop(name, 0); self.entries[name] = size
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                old, old_size = self.entries.popitem(last=False); self.total -= old_size
+                try: os.remove(os.path.join(self.folder, old))
+                except OSError: pass
+
+
+class ThumbnailPool:
+    def __init__(self, cache):
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="thumbnail")
+
+    def request(self, path, callback):
+        # callback(image, size) runs on a worker thread; image is None for non-images.
+        self.executor.submit(self._load, path, callback)
+
+    def _load(self, path, callback):
+        try: size = os.path.getsize(path)
+        except OSError: callback(None, 0); return
+        try: key = content_key(path, size)
+        except OSError: callback(None, size); return
+        hit, image = self.cache.get(key)
+        if not hit: image = make_thumbnail(path); self.cache.put(key, image)
+        callback(image, size)
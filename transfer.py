@@ -0,0 +1,391 @@
+import collections
+import hashlib
+import json
+import mmap
+import os
+import tarfile
+import threading
+import time
+import zlib
+import protocol
+from mux import CHUNK_SIZE, MAX_CHUNK_SIZE
+from protocol import ProtocolError
+
+# --- Transfer Engine ---
+MIN_CHUNK_SIZE = 16 * 1024
+# Integrity/resume granularity, independent of the wire chunk size chosen by ChunkSizer.
+MANIFEST_CHUNK_SIZE = 4 * 1024 * 1024
+STRIPE_MIN_SIZE = 64 * 1024 * 1024
+STRIPE_UNIT = 2 * MANIFEST_CHUNK_SIZE
+INITIAL_STRIPES, MAX_STRIPES = 2, 8
+STRIPE_SCALE_INTERVAL = 1.0
+INCOMPRESSIBLE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp3", ".aac", ".m4a", ".ogg", ".flac",
+                             ".mp4", ".mkv", ".mov", ".avi", ".webm", ".zip", ".7z", ".rar", ".gz", ".tgz", ".bz2",
+                             ".xz", ".zst", ".jar", ".apk", ".docx", ".xlsx", ".pptx"}
+
+
+class ChunkSizer:
+    # Sizes each chunk to roughly one bandwidth-delay product of the link, measured from the
+    # multiplexer's send rate and the handshake RTT. The delay term is capped so a single chunk
+    # never holds the socket long enough to noticeably delay a chat or drawing command.
+    def __init__(self, mux, rtt):
+        self.mux, self.delay = mux, min(max(rtt or 0, 0.01), 0.05)
+
+    def next_size(self):
+        if not self.mux.throughput: return CHUNK_SIZE
+        size = int(self.mux.throughput * self.delay) // MIN_CHUNK_SIZE * MIN_CHUNK_SIZE
+        return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, size))
+
+
+class ChunkCompressor:
+    # Per-transfer zlib stage. Known media/archive types are never tried; anything else is
+    # probed on its first chunks and left uncompressed unless that saves at least 10%. It also
+    # stands aside while compressing is slower than the link could carry the raw bytes, since
+    # the CPU would then be the bottleneck.
+    PROBE_CHUNKS, MIN_SAVING, LEVEL = 4, 0.1, 1
+
+    def __init__(self, filepath, mux):
+        self.filepath, self.mux = filepath, mux
+        self.compressible = os.path.splitext(filepath)[1].lower() not in INCOMPRESSIBLE_EXTENSIONS
+        self.probed = self.raw = self.packed = 0
+        self.rate, self.source = 0.0, None
+
+    @property
+    def active(self):
+        return self.compressible and (self.probed < self.PROBE_CHUNKS or not self.mux.throughput or self.rate >= self.mux.throughput)
+
+    def read(self, offset, size):
+        # A separate handle: the multiplexer reads this transfer's queued regions by seeking the main one.
+        if not self.source: self.source = open(self.filepath, 'rb')
+        self.source.seek(offset)
+        return self.source.read(size)
+
+    def compress(self, data):
+        started = time.perf_counter()
+        packed = zlib.compress(data, self.LEVEL)
+        elapsed = time.perf_counter() - started
+        if elapsed > 0: self.rate = len(data) / elapsed if not self.rate else 0.8 * self.rate + 0.2 * len(data) / elapsed
+        if self.probed < self.PROBE_CHUNKS:
+            self.probed += 1; self.raw += len(data); self.packed += len(packed)
+            if self.probed == self.PROBE_CHUNKS and self.packed > self.raw * (1 - self.MIN_SAVING): self.compressible = False
+        return packed if len(packed) < len(data) * (1 - self.MIN_SAVING) else None
+
+    def close(self):
+        if self.source: self.source.close()
+
+
+def queue_piece(channel, f, offset, size, compressor=None):
+    if compressor and compressor.active:
+        raw = compressor.read(offset, size)
+        packed = compressor.compress(raw)
+        if packed is not None: channel.write_compressed(packed, offset, size)
+        else: channel.write(raw, offset)
+    else: channel.write_region(f, offset, size)
+
+
+def stream_file(channel, filepath, sizer, ranges=None, compressor=None):
+    # Queues the file (or the given (offset, count) ranges of it) as file regions, read only when
+    # the writer reaches them, or as compressed chunks while the compressor is paying off.
+    try:
+        with open(filepath, 'rb') as f:
+            for start, count in ranges or [(0, os.fstat(f.fileno()).st_size)]:
+                offset, end = start, start + count
+                while offset < end:
+                    size = min(sizer.next_size(), end - offset)
+                    queue_piece(channel, f, offset, size, compressor); offset += size
+            # The writer thread still references the file for queued regions; wait until drained.
+            channel.close(); channel.wait_drained()
+    finally:
+        if compressor: compressor.close()
+
+
+class StripedSender:
+    # Splits the ranges into fixed units that the main channel and any number of extra TCP
+    # connections ("stripes") pull from a shared queue, so faster connections take more of the
+    # work. Every second the aggregate rate is measured and another stripe is opened for as long
+    # as the last one still raised throughput by more than 10%.
+    def __init__(self, filepath, ranges, channel, sizer, open_stripe, compressor=None):
+        self.filepath, self.channel, self.sizer, self.open_stripe = filepath, channel, sizer, open_stripe
+        self.compressor = compressor
+        self.units, self.cond, self.sent, self.error = collections.deque(), threading.Condition(), 0, None
+        for start, count in ranges:
+            for offset in range(start, start + count, STRIPE_UNIT): self.units.append((offset, min(start + count, offset + STRIPE_UNIT)))
+        self.workers, self.stripes, self.active_stripes = [], 0, 0
+
+    def _next_unit(self, wait=False):
+        # The main channel waits for live stripes, since a failing stripe hands its unit back.
+        with self.cond:
+            while wait and not self.units and not self.error and self.active_stripes: self.cond.wait()
+            return self.units.popleft() if self.units and not self.error else None
+
+    def _count(self, size):
+        with self.cond: self.sent += size
+
+    def _channel_worker(self):
+        try:
+            with open(self.filepath, 'rb') as f:
+                while unit := self._next_unit(wait=True):
+                    offset, end = unit
+                    while offset < end:
+                        size = min(self.sizer.next_size(), end - offset)
+                        queue_piece(self.channel, f, offset, size, self.compressor); self._count(size); offset += size
+                self.channel.close(); self.channel.wait_drained()
+        except Exception as e:
+            with self.cond: self.error = e; self.cond.notify_all()
+        finally:
+            if self.compressor: self.compressor.close()
+
+    def _stripe_worker(self, sock):
+        try:
+            with open(self.filepath, 'rb') as f:
+                while unit := self._next_unit():
+                    offset, end = unit
+                    try:
+                        while offset < end:
+                            size = min(MAX_CHUNK_SIZE, end - offset)
+                            sock.sendall(protocol.encode_data_header(self.channel.id, offset, size))
+                            if sock.sendfile(f, offset, size) != size: raise OSError("Source file shrank during transfer")
+                            self._count(size); offset += size
+                    except OSError:
+                        # Hand the whole unit back; the main channel or another stripe resends it.
+                        with self.cond: self.units.appendleft(unit)
+                        return
+        finally:
+            sock.close()
+            with self.cond: self.active_stripes -= 1; self.cond.notify_all()
+
+    def _add_stripe(self):
+        try: sock = self.open_stripe()
+        except (OSError, ProtocolError) as e: print(f"Could not open transfer stripe: {e}"); return False
+        with self.cond: self.active_stripes += 1
+        self._start(self._stripe_worker, sock); self.stripes += 1
+        return True
+
+    def _start(self, target, *args):
+        worker = threading.Thread(target=target, args=args, daemon=True); worker.start(); self.workers.append(worker)
+
+    def run(self):
+        self._start(self._channel_worker)
+        for _ in range(INITIAL_STRIPES): self._add_stripe()
+        last_sent, last_rate, growing, checked = 0, 0.0, True, time.monotonic()
+        while alive := [w for w in self.workers if w.is_alive()]:
+            alive[0].join(STRIPE_SCALE_INTERVAL)
+            if not growing or time.monotonic() - checked < STRIPE_SCALE_INTERVAL: continue
+            with self.cond: sent, remaining = self.sent, len(self.units)
+            rate = (sent - last_sent) / (time.monotonic() - checked)
+            growing = bool(remaining) and self.stripes < MAX_STRIPES and rate > last_rate * 1.1 and self._add_stripe()
+            last_sent, last_rate, checked = sent, rate, time.monotonic()
+        if self.error: raise self.error
+
+
+class FileSink:
+    # Pre-sizes the output file and maps it, so received DATA frames are written in place at
+    # their offset, directly from the socket when the frame reader supports it.
+    def __init__(self, path, size):
+        self.path, self.size = path, size
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if os.fstat(self.file.fileno()).st_size != size: self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size) if size else None
+        self.view = memoryview(self.map) if self.map else None
+
+    def target(self, offset, length):
+        if offset < 0 or offset + length > self.size: raise ProtocolError(f"DATA frame outside file bounds ({offset}+{length})")
+        return self.view[offset:offset + length]
+
+    def write(self, offset, data):
+        target = self.target(offset, len(data)); target[:] = data; target.release()
+
+    def close(self):
+        if self.map:
+            self.view.release(); self.map.flush()
+            try: self.map.close()
+            except BufferError: pass  # a frame view is still alive; the mapping closes when it is collected
+        self.file.close()
+
+
+# --- Manifests & Resume State ---
+def build_manifest(path, chunk_size=MANIFEST_CHUNK_SIZE):
+    whole, chunks, size = hashlib.sha256(), [], 0
+    with open(path, 'rb') as f:
+        while block := f.read(chunk_size):
+            whole.update(block); chunks.append(hashlib.sha256(block).hexdigest()); size += len(block)
+    return {"size": size, "chunk_size": chunk_size, "chunks": chunks, "digest": whole.hexdigest()}
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(1024 * 1024): digest.update(block)
+    return digest.hexdigest()
+
+
+class TransferState:
+    # Receiver-side progress for one file, persisted to a small JSON sidecar so an interrupted
+    # transfer can ask the sender for only the chunks that never arrived (or failed their hash).
+    SAVE_INTERVAL = 1.0
+
+    def __init__(self, path, file_id, filename, save_path, manifest, done=None, peer=None):
+        # `peer` is the sender's name, so a resume is only asked of the peer that has the file.
+        self.path, self.file_id, self.filename, self.save_path, self.manifest, self.peer = path, file_id, filename, save_path, manifest, peer
+        count = len(manifest["chunks"])
+        self.done = bytearray((done or "0" * count).encode('ascii'))
+        self.received, self._saved_at = [0] * count, 0.0
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f: info = json.load(f)
+        return cls(path, info["file_id"], info["filename"], info["save_path"], info["manifest"], info["done"], info.get("peer"))
+
+    @property
+    def complete(self): return b"0" not in self.done
+
+    @property
+    def received_bytes(self):
+        # Verified chunks plus the bytes received so far towards the others.
+        return sum(self.chunk_span(index)[1] if flag == ord("1") else self.received[index] for index, flag in enumerate(self.done))
+
+    def chunk_span(self, index):
+        start = index * self.manifest["chunk_size"]
+        return start, min(self.manifest["chunk_size"], self.manifest["size"] - start)
+
+    def missing_ranges(self):
+        ranges = []
+        for index, flag in enumerate(self.done):
+            if flag == ord("1"): continue
+            start, length = self.chunk_span(index)
+            if ranges and ranges[-1][0] + ranges[-1][1] == start: ranges[-1][1] += length
+            else: ranges.append([start, length])
+        return ranges
+
+    def record(self, offset, size):
+        # Returns the chunks whose bytes have now all arrived and are ready to verify.
+        completed, end, index = [], offset + size, offset // self.manifest["chunk_size"]
+        while offset < end and index < len(self.done):
+            start, length = self.chunk_span(index)
+            take = min(end, start + length) - offset
+            if self.done[index] == ord("0"):
+                self.received[index] += take
+                if self.received[index] >= length: completed.append(index)
+            offset += take; index += 1
+        return completed
+
+    def verify(self, index, sink):
+        start, length = self.chunk_span(index)
+        with sink.view[start:start + length] as view: ok = hashlib.sha256(view).hexdigest() == self.manifest["chunks"][index]
+        if ok: self.done[index] = ord("1")
+        else: self.received[index] = 0
+        return ok
+
+    def save(self, force=False):
+        if not force and time.monotonic() - self._saved_at < self.SAVE_INTERVAL: return
+        info = {"file_id": self.file_id, "filename": self.filename, "save_path": self.save_path,
+                "manifest": self.manifest, "done": self.done.decode('ascii'), "peer": self.peer}
+        with open(self.path + ".tmp", 'w') as f: json.dump(info, f)
+        os.replace(self.path + ".tmp", self.path)
+        self._saved_at = time.monotonic()
+
+    def remove(self):
+        if os.path.exists(self.path): os.remove(self.path)
+
+
+# --- Batch Archives ---
+# Several files or whole folders are sent as one tar stream on a single channel, offered and
+# accepted once. "w|" writes the archive strictly front to back, so it is cut into chunks and
+# queued as it is produced, never staged on disk; the receiver extracts with "r|" on its own
+# thread as the bytes arrive. Tar padding is small next to one round trip per file.
+BATCH_PREVIEW_NAMES = 8
+
+
+def batch_entries(paths):
+    # (path, arcname) for every file and folder under the given paths; names are relative to
+    # each top-level item's parent, so a dropped folder arrives as that folder. Symlinks and
+    # anything else that is not a plain file or folder are left out, as the receiver would
+    # refuse them anyway.
+    entries, kept = [], lambda path: not os.path.islink(path) and (os.path.isfile(path) or os.path.isdir(path))
+    for top in paths:
+        top = os.path.abspath(top); base = os.path.dirname(top)
+        if not kept(top): continue
+        entries.append((top, os.path.basename(top)))
+        if not os.path.isdir(top): continue
+        for root, dirs, files in os.walk(top):
+            dirs[:] = sorted(name for name in dirs if kept(os.path.join(root, name)))
+            for name in dirs + sorted(name for name in files if kept(os.path.join(root, name))):
+                path = os.path.join(root, name); entries.append((path, os.path.relpath(path, base).replace(os.sep, "/")))
+    return entries
+
+
+def batch_summary(entries):
+    files = [(arcname, os.path.getsize(path)) for path, arcname in entries if os.path.isfile(path)]
+    return {"files": len(files), "size": sum(size for _, size in files), "names": [arcname for arcname, _ in files[:BATCH_PREVIEW_NAMES]]}
+
+
+class ChannelWriter:
+    # The write-only file object tarfile streams into: buffers up to one ChunkSizer chunk and
+    # queues it on the channel at the next offset, blocking while the channel's queue is full.
+    def __init__(self, channel, sizer):
+        self.channel, self.sizer, self.buffer, self.offset = channel, sizer, bytearray(), 0
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.sizer.next_size(): self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self.buffer: return
+        self.channel.write(bytes(self.buffer), self.offset); self.offset += len(self.buffer); self.buffer.clear()
+
+
+def stream_archive(channel, entries, sizer):
+    writer = ChannelWriter(channel, sizer)
+    with tarfile.open(fileobj=writer, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for path, arcname in entries: tar.add(path, arcname, recursive=False)
+    writer.flush(); channel.close(); channel.wait_drained()
+
+
+class ArchiveReader:
+    # The read side of a streamed archive. The network loop feeds chunks in as they arrive and
+    # the extracting thread reads them out, waiting for more when it runs ahead. `on_read(n)` is
+    # called as bytes are consumed, which is when window credit is due, so a slow disk holds back
+    # the sender instead of growing this queue. Once aborted, queued and later chunks are dropped
+    # but still reported as read, so the sender's channel can run to its end.
+    def __init__(self, on_read):
+        self.chunks, self.cond, self.on_read = collections.deque(), threading.Condition(), on_read
+        self.consumed, self.aborted = 0, False
+
+    def feed(self, data):
+        with self.cond:
+            if not self.aborted: self.chunks.append(memoryview(data)); self.cond.notify(); return
+        self.on_read(len(data))
+
+    def abort(self):
+        with self.cond: self.aborted = True; dropped = sum(len(chunk) for chunk in self.chunks); self.chunks.clear(); self.cond.notify()
+        if dropped: self.on_read(dropped)
+
+    def read(self, size):
+        out = bytearray()
+        with self.cond:
+            while len(out) < size:
+                while not self.chunks and not self.aborted: self.cond.wait()
+                if self.aborted: raise ProtocolError("Archive stream aborted")
+                chunk = self.chunks.popleft(); take = size - len(out)
+                if len(chunk) > take: self.chunks.appendleft(chunk[take:]); chunk = chunk[:take]
+                out += chunk
+        self.consumed += len(out); self.on_read(len(out))
+        return bytes(out)
+
+
+def extract_archive(reader, dest):
+    # Only plain files and folders are extracted, and only inside dest: links, devices, absolute
+    # paths and ".." components are skipped, and the rest of the archive still extracts. Nothing
+    # already in dest is overwritten; existing folders are merged into.
+    # Returns the extracted file paths and the names of the skipped members.
+    dest, extracted, skipped = os.path.realpath(dest), [], []
+    options = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    with tarfile.open(fileobj=reader, mode="r|") as tar:
+        for member in tar:
+            path = os.path.realpath(os.path.join(dest, member.name))
+            if not (member.isfile() or member.isdir()) or os.path.commonpath([dest, path]) != dest: skipped.append(member.name); continue
+            if os.path.lexists(path) and not (member.isdir() and os.path.isdir(path)): skipped.append(member.name); continue
+            tar.extract(member, dest, set_attrs=member.isfile(), **options)
+            if member.isfile(): extracted.append(path)
+    return extracted, skipped
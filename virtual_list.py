@@ -0,0 +1,140 @@
+import bisect
+import itertools
+import sys
+import tkinter as tk
+import customtkinter as ctk
+
+# --- Virtualized List ---
+# A scrolling list that only builds widgets for the rows in view. Rows come from a small pool:
+# `make_row(parent)` creates a row widget once, `bind_row(row, key, record)` fills it with a data
+# record, and rows that scroll out of view go back to the pool for reuse. Row heights are measured
+# the first time a record is shown; unmeasured rows count as the average measured height.
+DEFAULT_ROW_HEIGHT = 40
+WHEEL_STEP = 40
+
+
+class VirtualList(ctk.CTkFrame):
+    def __init__(self, master, make_row, bind_row, on_top=None, label_text=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.make_row, self.bind_row, self.on_top = make_row, bind_row, on_top
+        self.keys, self.records, self.heights = [], {}, {}
+        self.top, self._offsets, self._width, self._pending = 0, None, 0, False
+        self._bound, self._pool, self._dirty = {}, [], set()
+        self.grid_columnconfigure(0, weight=1); self.grid_rowconfigure(1, weight=1)
+        if label_text: ctk.CTkLabel(self, text=label_text).grid(row=0, column=0, columnspan=2, pady=(5, 0))
+        self.viewport = ctk.CTkFrame(self, fg_color="transparent"); self.viewport.grid(row=1, column=0, sticky="nsew")
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._scrollbar_command); self.scrollbar.grid(row=1, column=1, sticky="ns")
+        self.viewport.bind("<Configure>", self._resized)
+        self._bind_wheel(self.viewport)
+
+    # --- Data ---
+    def __contains__(self, key): return key in self.records
+    def __len__(self): return len(self.keys)
+    def get(self, key): return self.records.get(key)
+
+    def append(self, key, record):
+        if key in self.records: return
+        self.keys.append(key); self.records[key] = record
+        self._changed()
+
+    def prepend(self, items):
+        # Older rows go above the view; `top` moves down by their height so nothing visibly jumps.
+        items = [(key, record) for key, record in items if key not in self.records]
+        if not items: return
+        self.keys[:0] = [key for key, _ in items]; self.records.update(items)
+        self.top += sum(self._height(key) for key, _ in items)
+        self._changed()
+
+    def update(self, key, record):
+        if key not in self.records: return
+        self.records[key] = record; self.heights.pop(key, None); self._dirty.add(key)
+        self._changed()
+
+    def remove(self, key):
+        if self.records.pop(key, None) is None: return
+        self.keys.remove(key); self.heights.pop(key, None)
+        self._changed()
+
+    def clear(self):
+        self.keys, self.records, self.heights, self.top = [], {}, {}, 0
+        self._changed()
+
+    def scroll_to_end(self): self.top = float("inf"); self._schedule()
+
+    # --- Layout ---
+    def _height(self, key):
+        if key in self.heights: return self.heights[key]
+        return sum(self.heights.values()) / len(self.heights) if self.heights else DEFAULT_ROW_HEIGHT
+
+    def _changed(self): self._offsets = None; self._schedule()
+
+    def _schedule(self):
+        if not self._pending: self._pending = True; self.after_idle(self._render)
+
+    def _resized(self, event):
+        if event.width != self._width:
+            # Wrapped text reflows, so every height is stale and every visible row must rebind.
+            self._width = event.width; self.heights.clear(); self._dirty.update(self._bound)
+            self._offsets = None
+        self._schedule()
+
+    def _render(self):
+        self._pending = False
+        for _ in range(3):
+            # Newly bound rows are measured and the layout redone until the heights settle.
+            if not self._layout(): break
+        if self.on_top and self.top <= 0 and self.keys: self.on_top()
+
+    def _layout(self):
+        if self._offsets is None: self._offsets = [0] + list(itertools.accumulate(self._height(key) for key in self.keys))
+        offsets, view = self._offsets, max(1, self.viewport.winfo_height())
+        total = offsets[-1]
+        self.top = max(0, min(self.top, total - view))
+        first = max(0, bisect.bisect_right(offsets, self.top) - 1)
+        visible, i = [], first
+        while i < len(self.keys) and offsets[i] < self.top + view: visible.append(i); i += 1
+        keys = {self.keys[i] for i in visible}
+        for key in [k for k in self._bound if k not in keys]:
+            row = self._bound.pop(key); row.place_forget(); self._pool.append(row)
+        fresh = []
+        for i in visible:
+            key = self.keys[i]
+            row = self._bound.get(key)
+            if row is None:
+                row = self._pool.pop() if self._pool else self._new_row()
+                self._bound[key] = row; fresh.append(key)
+            elif key in self._dirty: fresh.append(key)
+            if key in fresh: self.bind_row(row, key, self.records[key])
+            row.place(x=0, y=offsets[i] - self.top, relwidth=1)
+        self._dirty.difference_update(fresh)
+        self.scrollbar.set(self.top / total if total else 0, (self.top + view) / total if total else 1)
+        if not fresh: return False
+        self.viewport.update_idletasks()
+        changed = False
+        for key in fresh:
+            height = self._bound[key].winfo_reqheight()
+            if self.heights.get(key) != height: self.heights[key] = height; changed = True
+        if changed: self._offsets = None
+        return changed
+
+    # --- Scrolling ---
+    def _new_row(self):
+        row = self.make_row(self.viewport)
+        self._bind_wheel(row)
+        return row
+
+    def _bind_wheel(self, widget):
+        # Plain Tk bindings on every widget in the row; CTk's own bind() would also forward to
+        # each widget's internal canvas and label, which this walk reaches anyway.
+        if sys.platform.startswith("linux"):
+            tk.Misc.bind(widget, "<Button-4>", lambda e: self._scroll_by(-WHEEL_STEP), "+"); tk.Misc.bind(widget, "<Button-5>", lambda e: self._scroll_by(WHEEL_STEP), "+")
+        else: tk.Misc.bind(widget, "<MouseWheel>", lambda e: self._scroll_by(-e.delta / 120 * WHEEL_STEP), "+")
+        for child in widget.winfo_children(): self._bind_wheel(child)
+
+    def _scroll_by(self, pixels): self.top = max(0, self.top + pixels); self._schedule()
+
+    def _scrollbar_command(self, *args):
+        total = self._offsets[-1] if self._offsets else 0
+        if args[0] == "moveto": self.top = float(args[1]) * total
+        elif args[0] == "scroll": self.top += int(args[1]) * (self.viewport.winfo_height() if args[2] == "pages" else WHEEL_STEP)
+        self._scroll_by(0)